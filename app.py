@@ -1,12 +1,21 @@
 # app.py
-from flask import Flask, render_template, current_app, request
+import time
+
+from flask import Flask, render_template, current_app, request, session
 from config import Config
 from models import catalog  # catalog.COURSE_CATALOG
 
 # DB / Login
-from services.db import init_db, create_all, get_session
+from services.db import init_db, init_read_engine, create_all, get_session
+from services.partitions import init_partitions
 from services.models import User
-from flask_login import LoginManager
+from services import entitlements
+from services.profiling import init_profiling
+from services import template_cache
+from services.assets import init_assets
+from services.jsoncodec import FastJSONProvider
+from services.health import init_health, mark_ready
+from flask_login import LoginManager, current_user
 
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"  # type: ignore[assignment]
@@ -15,11 +24,39 @@ login_manager.login_view = "auth.login"  # type: ignore[assignment]
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    # jsonify / get_json / tojson 改走 jsoncodec（orjson 可用時較快）
+    app.json = FastJSONProvider(app)
 
     # ---- 初始化資料庫（用 get + 預設，避免 KeyError）----
     db_uri = app.config.get("SQLALCHEMY_DATABASE_URI", "sqlite:///coursepay.db")
-    init_db(db_uri, echo=app.config.get("SQLALCHEMY_ECHO", False))
+    init_db(
+        db_uri,
+        echo=app.config.get("SQLALCHEMY_ECHO", False),
+        sqlite_wal=app.config.get("SQLITE_WAL", True),
+    )
     create_all()
+    # payments 月份分區：封存表補欄位 / 重建 payments_all view（SQLite）
+    init_partitions()
+
+    # ---- 唯讀 Engine（後台/報表查詢；不可用或延遲過大時自動回主庫）----
+    if app.config.get("READ_REPLICA_ENABLED", True):
+        init_read_engine(
+            app.config.get("READ_DATABASE_URL") or None,
+            echo=app.config.get("SQLALCHEMY_ECHO", False),
+            max_lag=app.config.get("READ_REPLICA_MAX_LAG_SECONDS", 5.0),
+        )
+
+    # ---- 靜態檔：雜湊檔名 + 預壓縮（flask assets build）----
+    init_assets(app)
+
+    # ---- Jinja bytecode 快取（磁碟，worker 共用）----
+    template_cache.init_template_cache(app)
+
+    # ---- 延遲統計 / 取樣 profiler ----
+    init_profiling(app)
+
+    # ---- 健康檢查（/livez、/readyz、/health）與 SIGTERM drain ----
+    init_health(app)
 
     # ---- 初始化 Flask-Login ----
     login_manager.init_app(app)
@@ -45,6 +82,17 @@ def create_app():
     app.register_blueprint(billing_bp, url_prefix="/billing")
     app.register_blueprint(speech_bp, url_prefix="/speech")
 
+    # ---- 模板暖機：所有模板先編譯好，第一個請求不用等 ----
+    if app.config.get("TEMPLATE_WARMUP", True):
+        template_cache.warm_up(app)
+
+    # ---- CLI：outbox worker（flask outbox dispatch）----
+    _register_outbox_cli(app)
+    _register_reconcile_cli(app)
+    _register_templates_cli(app)
+    _register_assets_cli(app)
+    _register_partitions_cli(app)
+
     # ---- 頁面與健康檢查 ----
     @app.get("/")
     def index():
@@ -67,9 +115,19 @@ def create_app():
                 error="(測試) 強制顯示備援頁"
             ), 500
 
-        # 3) 正常情況：嘗試渲染主頁，失敗才回備援頁
+        # 3) 已登入：取得已購課程（行程內快取），用來顯示「已購買」
+        owned = frozenset()
+        if current_user.is_authenticated:
+            # 剛結帳完成（/billing/success 設定）時略過快取，webhook 可能由其他 worker 寫入
+            fresh = session.get(entitlements.REFRESH_SESSION_KEY, 0) > time.time()
+            try:
+                owned = entitlements.entitled_courses(current_user.id, fresh=fresh)
+            except Exception:
+                current_app.logger.exception("Load entitlements failed")
+
+        # 4) 正常情況：嘗試渲染主頁，失敗才回備援頁
         try:
-            return render_template("courses.html", items=items)
+            return render_template("courses.html", items=items, owned=owned)
         except Exception as e:
             current_app.logger.exception("Render courses failed")
             return render_template("courses_fallback.html", items=items, error=str(e)), 500
@@ -90,10 +148,6 @@ def create_app():
             error="(測試) 這是手動顯示的備援頁"
         )
 
-    @app.get("/health")
-    def health():
-        return {"status": "ok"}
-
     @app.get("/debug/keys")
     def debug_keys():
         return {
@@ -103,8 +157,161 @@ def create_app():
             "database_url": app.config.get("SQLALCHEMY_DATABASE_URI", "N/A"),
         }
 
+    # 全部初始化完成（含模板暖機）才讓 readiness 回 200
+    mark_ready()
     return app
 
 
+def _register_outbox_cli(app: Flask) -> None:
+    import click
+    from services import outbox
+
+    @app.cli.group("outbox")
+    def outbox_cli():
+        """Transactional outbox 工具"""
+
+    @outbox_cli.command("dispatch")
+    @click.option("--batch-size", default=50, show_default=True)
+    @click.option("--lease", "lease_seconds", default=60.0, show_default=True)
+    @click.option("--max-attempts", default=8, show_default=True)
+    @click.option("--once", is_flag=True, help="只處理一批就結束")
+    def outbox_dispatch(batch_size: int, lease_seconds: float, max_attempts: int, once: bool):
+        """處理 outbox 訊息（可多個行程同時執行）"""
+        import signal
+
+        d = outbox.Dispatcher(
+            batch_size=batch_size, lease_seconds=lease_seconds, max_attempts=max_attempts
+        )
+        # SIGTERM：不再認領新批次，手上這批處理完（並寫回結果）才結束
+        signal.signal(signal.SIGTERM, lambda *_: d.stop())
+        try:
+            if once:
+                d.run_once()
+            else:
+                d.run_forever()
+        except KeyboardInterrupt:
+            d.stop()
+        click.echo(d.stats())
+
+    @outbox_cli.command("stats")
+    def outbox_stats():
+        """顯示佇列狀態（pending/done/dead 與 lag）"""
+        click.echo(outbox.queue_stats())
+
+
+def _register_reconcile_cli(app: Flask) -> None:
+    import click
+    from datetime import datetime, timedelta
+
+    @app.cli.command("reconcile")
+    @click.option("--from", "date_from", required=True, help="YYYY-MM-DD（UTC，含）")
+    @click.option("--to", "date_to", required=True, help="YYYY-MM-DD（UTC，含當日）")
+    @click.option("--concurrency", default=4, show_default=True)
+    @click.option("--window-hours", default=24, show_default=True)
+    @click.option("--checkpoint", default=None, help="checkpoint JSON 路徑（中斷後可續跑）")
+    @click.option("--dry-run", is_flag=True, help="只比對不寫入")
+    def reconcile_cmd(date_from, date_to, concurrency, window_hours, checkpoint, dry_run):
+        """與 Stripe 對帳：補寫 payments 缺少的已完成 Checkout Session"""
+        from services.reconcile import reconcile, stripe_lister
+
+        api_key = app.config.get("STRIPE_API_KEY")
+        if not api_key:
+            raise click.UsageError("STRIPE_API_KEY 未設定（可搭配 STRIPE_API_BASE 指向 stripe-mock）")
+        lister = stripe_lister(api_key, app.config.get("STRIPE_API_BASE") or None)
+        report = reconcile(
+            datetime.strptime(date_from, "%Y-%m-%d"),
+            datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1),
+            lister,
+            concurrency=concurrency,
+            window=timedelta(hours=window_hours),
+            checkpoint_path=checkpoint,
+            dry_run=dry_run,
+        )
+        click.echo(report.as_dict())
+        if not report.ok:
+            raise click.ClickException(
+                f"{len(report.failed_windows)} window(s) failed; rerun with the same --checkpoint"
+            )
+
+
+def _register_templates_cli(app: Flask) -> None:
+    import click
+
+    @app.cli.group("templates")
+    def templates_cli():
+        """Jinja 模板工具"""
+
+    @templates_cli.command("compile")
+    @click.option("--no-rebuild", is_flag=True, help="保留既有 bytecode 快取（只量測載入時間）")
+    def templates_compile(no_rebuild: bool):
+        """預先編譯所有模板並寫入 bytecode 快取（部署建置步驟）"""
+        timings = template_cache.precompile_templates(app, rebuild=not no_rebuild)
+        for name, ms in timings.items():
+            if name != "__total__":
+                click.echo(f"{ms:>9.3f} ms  {name}")
+        click.echo(f"{timings['__total__']:>9.3f} ms  total ({len(timings) - 1} templates)")
+
+
+def _register_assets_cli(app: Flask) -> None:
+    import click
+    from services.assets import build_assets
+
+    @app.cli.group("assets")
+    def assets_cli():
+        """靜態檔建置工具"""
+
+    @assets_cli.command("build")
+    @click.option("--keep", default=3, show_default=True, help="保留最近幾代 build 的雜湊檔（含本次）")
+    def assets_build(keep: int):
+        """產生雜湊檔名、gzip/brotli 預壓縮檔與 manifest（static/dist/）"""
+        manifest = build_assets(app.static_folder or "static", keep=keep)
+        for src, hashed in manifest.items():
+            click.echo(f"{src} -> {hashed}")
+
+
+def _register_partitions_cli(app: Flask) -> None:
+    import click
+    from datetime import datetime
+    from pathlib import Path
+    from services import partitions
+
+    @app.cli.group("partitions")
+    def partitions_cli():
+        """payments 月份分區管理"""
+
+    @partitions_cli.command("rotate")
+    @click.option("--hot-months", default=None, type=int, help="SQLite：熱表保留的月數（含本月）")
+    @click.option("--premake", default=None, type=int, help="PostgreSQL：預先建立的未來月份數")
+    def partitions_rotate(hot_months, premake):
+        """建立 / 輪替分區（建議每日排程）"""
+        report = partitions.rotate(
+            hot_months=hot_months or app.config.get("PAYMENTS_HOT_MONTHS", 3),
+            premake=premake if premake is not None else app.config.get("PAYMENTS_PREMAKE_MONTHS", 2),
+        )
+        click.echo(report)
+
+    @partitions_cli.command("list")
+    def partitions_list():
+        """列出月份分區"""
+        from services.db import get_engine
+        for month, name in partitions.list_partitions(get_engine()):
+            click.echo(f"{month:%Y-%m}  {name}")
+
+    @partitions_cli.command("detach")
+    @click.option("--month", required=True, help="YYYY-MM")
+    @click.option("--cold-dir", default=None, help="輸出目錄（預設 PAYMENTS_COLD_DIR 或 instance/cold）")
+    @click.option("--allow-entitled", is_flag=True, help="分區內有已付款資料也移除（會失去課程權限）")
+    def partitions_detach(month, cold_dir, allow_entitled):
+        """把某月分區匯出成 JSON Lines（gzip）後移除"""
+        cold_dir = cold_dir or app.config.get("PAYMENTS_COLD_DIR") or Path(app.instance_path) / "cold"
+        try:
+            path = partitions.detach(
+                datetime.strptime(month, "%Y-%m"), cold_dir, allow_entitled=allow_entitled
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(str(path))
+
+
 # 方便 flask run
 app = create_app()
@@ -0,0 +1,2 @@
+# bench/__init__.py
+# 效能基準測試套件（離線執行）：python -m bench.seed / python -m bench.run
@@ -0,0 +1,103 @@
+# bench/json_codec.py
+"""
+JSON 編解碼微基準：標準庫 json vs services.jsoncodec（orjson 可用時）。
+
+    python -m bench.json_codec --number 20000
+
+比較項目：
+  loads / dumps   單純解析與序列化一個 checkout.session.completed 事件
+  webhook         stdlib：construct_event() + json.dumps（舊 webhook 路徑）
+                  codec ：verify_header() + jsoncodec.loads() + Raw（新路徑，不重新序列化）
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable, Dict
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from bench.run import BENCH_WEBHOOK_SECRET, sign_stripe_payload  # noqa: E402
+from services import jsoncodec  # noqa: E402
+
+
+def sample_event() -> dict:
+    """接近實際內容的 checkout.session.completed 事件（約 1.6KB）。"""
+    session = {
+        "id": "cs_test_a1b2c3d4e5f6g7h8i9j0", "object": "checkout.session",
+        "amount_subtotal": 149000, "amount_total": 149000, "currency": "twd",
+        "customer_details": {
+            "address": {"city": None, "country": "TW", "line1": None, "line2": None,
+                        "postal_code": None, "state": None},
+            "email": "buyer@example.com", "name": "王小明", "phone": None,
+            "tax_exempt": "none", "tax_ids": [],
+        },
+        "metadata": {"course_id": "course_flask_web", "user_id": "42"},
+        "mode": "payment", "payment_status": "paid", "status": "complete",
+        "payment_intent": "pi_3Nabcdefghijklmnop", "payment_method_types": ["card"],
+        "success_url": "https://example.com/billing/success?session_id={CHECKOUT_SESSION_ID}",
+        "cancel_url": "https://example.com/billing/cancel",
+        "total_details": {"amount_discount": 0, "amount_shipping": 0, "amount_tax": 0},
+        "created": 1760000000, "expires_at": 1760086400, "livemode": False,
+        "automatic_tax": {"enabled": False, "liability": None, "status": None},
+        "custom_fields": [], "custom_text": {"after_submit": None, "shipping_address": None,
+                                             "submit": None, "terms_of_service_acceptance": None},
+        "invoice_creation": {"enabled": False, "invoice_data": {
+            "account_tax_ids": None, "custom_fields": None, "description": None,
+            "footer": None, "issuer": None, "metadata": {}, "rendering_options": None}},
+        "phone_number_collection": {"enabled": False},
+    }
+    return {
+        "id": "evt_1Nabcdefghijklmnop", "object": "event", "api_version": "2024-10-28.acacia",
+        "created": 1760000001, "livemode": False, "pending_webhooks": 1,
+        "request": {"id": None, "idempotency_key": None},
+        "type": "checkout.session.completed", "data": {"object": session},
+    }
+
+
+def main() -> None:
+    import stripe
+
+    p = argparse.ArgumentParser(description="JSON codec micro-benchmark")
+    p.add_argument("--number", type=int, default=20000)
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    event = sample_event()
+    raw = json.dumps(event).encode("utf-8")
+    text = raw.decode("utf-8")
+    sig = sign_stripe_payload(raw, BENCH_WEBHOOK_SECRET, ts=2_000_000_000)
+
+    def webhook_old():
+        ev = stripe.Webhook.construct_event(raw, sig, BENCH_WEBHOOK_SECRET, tolerance=None)
+        json.dumps(ev)
+
+    def webhook_new():
+        stripe.WebhookSignature.verify_header(text, sig, BENCH_WEBHOOK_SECRET, tolerance=None)
+        jsoncodec.loads(raw)
+        jsoncodec.dumps(jsoncodec.Raw(raw))
+
+    cases: Dict[str, Dict[str, Callable[[], object]]] = {
+        "loads": {"stdlib": lambda: json.loads(raw), "codec": lambda: jsoncodec.loads(raw)},
+        "dumps": {"stdlib": lambda: json.dumps(event), "codec": lambda: jsoncodec.dumps(event)},
+        "webhook": {"stdlib": webhook_old, "codec": webhook_new},
+    }
+
+    print(f"backend={jsoncodec.BACKEND} payload={len(raw)} bytes number={args.number}")
+    for name, impls in cases.items():
+        best = {
+            label: min(timeit.repeat(fn, number=args.number, repeat=args.repeat)) / args.number * 1e6
+            for label, fn in impls.items()
+        }
+        speedup = best["stdlib"] / best["codec"] if best["codec"] else float("inf")
+        print(f"{name:8s} stdlib={best['stdlib']:8.2f}us  codec={best['codec']:8.2f}us  x{speedup:.2f}")
+
+
+if __name__ == "__main__":
+    main()
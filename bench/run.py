@@ -0,0 +1,315 @@
+# bench/run.py
+"""
+端對端基準測試：以 Flask test client 在行程內驅動各路由（不需網路、不需 Stripe）。
+
+    python -m bench.seed --db bench/bench.db --payments 1000000 --events 10000000
+    python -m bench.run --db bench/bench.db --requests 500 --concurrency 4 \
+        --out bench/results/latest.json --compare bench/results/baseline.json
+
+情境：
+  courses         GET  /courses
+  checkout_echo   POST /billing/checkout（STRIPE_API_KEY 留空 → echo 模式）
+  webhook         POST /billing/webhook（本地以 STRIPE_WEBHOOK_SECRET 產生合法簽章）
+  admin_deep_page GET  /admin/payments?page=<中段頁碼>
+  admin_search    GET  /admin/payments?q=...&date_from=...
+  auth_login      POST /auth/login
+
+輸出各情境 p50/p95/p99（毫秒）、吞吐量（req/s）、錯誤數與 RSS 增量，以及整個行程的峰值 RSS，
+存成 JSON；加上 --compare 時與先前結果比較，p95 變慢或吞吐量下降超過 --threshold、
+或錯誤數 / 錯誤率上升即標記為 regression（有 regression 時結束碼為 1，可接在 CI）。
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+BENCH_WEBHOOK_SECRET = "whsec_bench_local"
+
+Scenario = Callable[[Any], Any]
+
+
+# -----------------------------
+# 量測工具
+# -----------------------------
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩（nearest-rank）百分位數；輸入需已排序。"""
+    if not sorted_values:
+        return 0.0
+    k = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    整個行程至今的峰值 RSS（MB），只增不減，不能拿來歸咎單一情境；
+    不支援的平台（如 Windows 無 resource 模組）回 None。
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位為 KB、macOS 為 bytes
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def current_rss_mb() -> Optional[float]:
+    """目前 RSS（MB）；僅 Linux（/proc/self/statm），其他平台回 None。"""
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            pages = int(fh.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
+def sign_stripe_payload(payload: bytes, secret: str, ts: Optional[int] = None) -> str:
+    """產生與 Stripe 相同格式的 Stripe-Signature 標頭（t=...,v1=HMAC-SHA256）。"""
+    ts = ts or int(time.time())
+    mac = hmac.new(secret.encode(), f"{ts}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={ts},v1={mac}"
+
+
+# -----------------------------
+# 情境
+# -----------------------------
+def _expect(resp, *codes: int):
+    if resp.status_code not in codes:
+        raise RuntimeError(f"unexpected status {resp.status_code}")
+    return resp
+
+
+def build_scenarios(total_payments: int) -> Dict[str, Scenario]:
+    deep_page = max(total_payments // 100 // 2, 1)
+    date_from = (datetime.utcnow() - timedelta(days=30)).strftime("%Y-%m-%d")
+
+    def courses(c):
+        return _expect(c.get("/courses"), 200)
+
+    def checkout_echo(c):
+        return _expect(c.post("/billing/checkout", data={"course_id": "course_flask_web"}), 200)
+
+    def webhook(c):
+        sid = f"cs_bench_live_{uuid.uuid4().hex}"
+        body = json.dumps({
+            "id": f"evt_bench_live_{uuid.uuid4().hex}",
+            "type": "checkout.session.completed",
+            "data": {"object": {
+                "id": sid, "amount_total": 149000, "payment_status": "paid",
+                "metadata": {"course_id": "course_flask_web", "user_id": "1"},
+                "customer_details": {"email": "bench@example.com"},
+            }},
+        }).encode()
+        headers = {
+            "Stripe-Signature": sign_stripe_payload(body, BENCH_WEBHOOK_SECRET),
+            "Content-Type": "application/json",
+        }
+        return _expect(c.post("/billing/webhook", data=body, headers=headers), 200)
+
+    def admin_deep_page(c):
+        return _expect(c.get(f"/admin/payments?page={deep_page}&page_size=100"), 200)
+
+    def admin_search(c):
+        return _expect(c.get(f"/admin/payments?q=user1&date_from={date_from}&page=2"), 200)
+
+    def auth_login(c):
+        from bench.seed import BENCH_PASSWORD, BENCH_USER_EMAIL
+        return _expect(c.post("/auth/login", data={
+            "email": BENCH_USER_EMAIL, "password": BENCH_PASSWORD,
+        }), 302)
+
+    return {
+        "courses": courses,
+        "checkout_echo": checkout_echo,
+        "webhook": webhook,
+        "admin_deep_page": admin_deep_page,
+        "admin_search": admin_search,
+        "auth_login": auth_login,
+    }
+
+
+def run_scenario(app, fn: Scenario, requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    """
+    每個執行緒各自一個 test client；回傳延遲分位數、吞吐量、錯誤數與 RSS 增量。
+    暖機失敗不中斷整個 run，計入 errors（另記 warmup_errors）。
+    """
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "c"):
+            local.c = app.test_client()
+        return local.c
+
+    rss_before = current_rss_mb()
+    warmup_errors = 0
+    for _ in range(warmup):
+        try:
+            fn(app.test_client())
+        except Exception:
+            warmup_errors += 1
+
+    latencies: List[float] = []
+    errors = warmup_errors
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            fn(client())
+            ok = True
+        except Exception:
+            ok = False
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+            if not ok:
+                errors += 1
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - t_start
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3)  # noqa: E731
+    rss_after = current_rss_mb()
+    attempts = requests + warmup
+    return {
+        "requests": requests,
+        "errors": errors,
+        "warmup_errors": warmup_errors,
+        "error_rate": round(errors / attempts, 4) if attempts else 0.0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+        "throughput_rps": round(requests / wall, 2) if wall else 0.0,
+        # 本情境前後的 RSS 差（MB）；峰值 RSS 只在整個 run 報一次
+        "rss_growth_mb": (
+            round(rss_after - rss_before, 1)
+            if rss_before is not None and rss_after is not None else None
+        ),
+    }
+
+
+# -----------------------------
+# 比較
+# -----------------------------
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    p95 上升或吞吐量下降超過 threshold（比例）就列為 regression；
+    錯誤數或錯誤率只要上升就列入（快速失敗的請求會讓延遲、吞吐量看起來「變好」）。
+    """
+    problems = []
+    for name, cur in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        old_errors, cur_errors = old.get("errors", 0), cur.get("errors", 0)
+        old_rate = old.get("error_rate", old_errors / old["requests"] if old.get("requests") else 0.0)
+        cur_rate = cur.get("error_rate", cur_errors / cur["requests"] if cur.get("requests") else 0.0)
+        if cur_errors > old_errors or cur_rate > old_rate:
+            problems.append(f"{name}: errors {old_errors} ({old_rate:.2%}) -> {cur_errors} ({cur_rate:.2%})")
+        if old["p95_ms"] and cur["p95_ms"] > old["p95_ms"] * (1 + threshold):
+            problems.append(f"{name}: p95 {old['p95_ms']}ms -> {cur['p95_ms']}ms")
+        if old["throughput_rps"] and cur["throughput_rps"] < old["throughput_rps"] * (1 - threshold):
+            problems.append(f"{name}: throughput {old['throughput_rps']} -> {cur['throughput_rps']} req/s")
+    return problems
+
+
+# -----------------------------
+# 進入點
+# -----------------------------
+def _make_app(db_url: str):
+    # Config 在 import 時讀環境變數，必須先設好再載入 app
+    os.environ["DATABASE_URL"] = db_url
+    os.environ["STRIPE_API_KEY"] = ""
+    os.environ["STRIPE_WEBHOOK_SECRET"] = BENCH_WEBHOOK_SECRET
+    project_root = Path(__file__).resolve().parents[1]
+    if str(project_root) not in sys.path:
+        sys.path.insert(0, str(project_root))
+    from app import app
+    app.config.update(
+        STRIPE_API_KEY="",
+        STRIPE_WEBHOOK_SECRET=BENCH_WEBHOOK_SECRET,
+        TESTING=False,
+    )
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from bench.seed import db_url as to_db_url
+
+    p = argparse.ArgumentParser(description="Run CoursePay end-to-end benchmarks")
+    p.add_argument("--db", default="bench/bench.db", help="先以 python -m bench.seed 建立")
+    p.add_argument("--requests", type=int, default=200, help="每個情境的請求數")
+    p.add_argument("--concurrency", type=int, default=1)
+    p.add_argument("--warmup", type=int, default=5)
+    p.add_argument("--only", action="append", help="只跑指定情境（可重複）")
+    p.add_argument("--out", default=None, help="結果 JSON 路徑（預設 bench/results/<時間>.json）")
+    p.add_argument("--compare", default=None, help="與此 JSON 比較")
+    p.add_argument("--threshold", type=float, default=0.10, help="regression 門檻（比例）")
+    args = p.parse_args(argv)
+
+    app = _make_app(to_db_url(args.db))
+
+    from sqlalchemy import func, select
+    from services.db import get_session
+    from services.models import Payment
+    with get_session() as s:
+        total_payments = s.scalar(select(func.count()).select_from(Payment)) or 0
+
+    scenarios = build_scenarios(total_payments)
+    selected = args.only or list(scenarios)
+
+    results: Dict[str, Any] = {
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "db": args.db,
+        "payments": total_payments,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "scenarios": {},
+    }
+    for name in selected:
+        r = run_scenario(app, scenarios[name], args.requests, args.concurrency, args.warmup)
+        results["scenarios"][name] = r
+        print(f"{name:16s} p50={r['p50_ms']:>9}ms p95={r['p95_ms']:>9}ms p99={r['p99_ms']:>9}ms "
+              f"{r['throughput_rps']:>9} req/s  errors={r['errors']}  rss_growth={r['rss_growth_mb']}MB")
+    results["peak_rss_mb"] = peak_rss_mb()
+    print(f"process peak RSS: {results['peak_rss_mb']}MB")
+
+    out = Path(args.out) if args.out else (
+        Path(__file__).resolve().parent / "results" / f"{datetime.utcnow():%Y%m%dT%H%M%SZ}.json"
+    )
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"saved: {out}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        problems = compare(results, baseline, args.threshold)
+        for line in problems:
+            print(f"REGRESSION {line}")
+        if problems:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+# bench/seed.py
+"""
+建立基準測試用的資料庫並灌入大量資料（payments / webhook_events / users）。
+
+    python -m bench.seed --db bench/bench.db --payments 1000000 --events 10000000
+
+以 Core 的 executemany 分批 INSERT（不經 ORM 物件），大量資料時仍可在合理時間完成。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from sqlalchemy import func, insert, select
+
+BENCH_PASSWORD = "bench-password"
+BENCH_USER_EMAIL = "bench@example.com"
+
+_COURSES = ["course_py_basic", "course_flask_web", "course_speech_ai"]
+_STATUSES = ["paid"] * 18 + ["unpaid", "no_payment_required"]
+
+
+def _batches(total: int, size: int) -> Iterator[range]:
+    for start in range(0, total, size):
+        yield range(start, min(start + size, total))
+
+
+def _payment_rows(idx: range, users: int, now: datetime, days: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    rows = []
+    for i in idx:
+        uid = (i % users) + 1 if users else None
+        rows.append({
+            "stripe_session_id": f"cs_bench_{i:010d}",
+            "course_id": _COURSES[i % len(_COURSES)],
+            "amount_twd": rnd.choice((990, 1490, 1990)),
+            "status": rnd.choice(_STATUSES),
+            "buyer_email": f"user{uid or i}@example.com",
+            "user_id": uid,
+            "created_at": now - timedelta(seconds=rnd.randrange(days * 86400)),
+        })
+    return rows
+
+
+def _event_rows(idx: range, now: datetime, days: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    types = ("checkout.session.completed", "payment_intent.succeeded", "charge.succeeded")
+    rows = []
+    for i in idx:
+        etype = types[i % len(types)]
+        rows.append({
+            "event_id": f"evt_bench_{i:011d}",
+            "type": etype,
+            "payload": {"id": f"evt_bench_{i:011d}", "type": etype,
+                        "data": {"object": {"id": f"obj_{i}", "amount_total": 99000}}},
+            "created_at": now - timedelta(seconds=rnd.randrange(days * 86400)),
+        })
+    return rows
+
+
+def seed(
+    db_url: str,
+    payments: int = 10_000,
+    events: int = 10_000,
+    users: int = 1_000,
+    days: int = 365,
+    batch_size: int = 10_000,
+    seed_value: int = 42,
+) -> Dict[str, Any]:
+    """建表並灌資料；回傳各表筆數與耗時。資料表已有資料時只補不足的部分。"""
+    from services.db import init_db, create_all, get_session
+    from services.models import Payment, User, WebhookEvent
+    from werkzeug.security import generate_password_hash
+
+    init_db(db_url)
+    create_all()
+    rnd = random.Random(seed_value)
+    now = datetime.utcnow()
+    timings: Dict[str, float] = {}
+
+    with get_session() as s:
+        have_users = s.scalar(select(func.count()).select_from(User)) or 0
+        have_payments = s.scalar(select(func.count()).select_from(Payment)) or 0
+        have_events = s.scalar(select(func.count()).select_from(WebhookEvent)) or 0
+
+        t0 = time.perf_counter()
+        if have_users < users:
+            # 雜湊計算昂貴：全部共用同一個密碼雜湊
+            pw_hash = generate_password_hash(BENCH_PASSWORD)
+            for idx in _batches(users - have_users, batch_size):
+                s.execute(insert(User), [
+                    {"email": BENCH_USER_EMAIL if have_users + i == 0 else f"user{have_users + i + 1}@example.com",
+                     "password_hash": pw_hash, "plan": "free", "created_at": now}
+                    for i in idx
+                ])
+            s.commit()
+        timings["users"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for idx in _batches(max(payments - have_payments, 0), batch_size):
+            shifted = range(idx.start + have_payments, idx.stop + have_payments)
+            s.execute(insert(Payment), _payment_rows(shifted, users, now, days, rnd))
+            s.commit()
+        timings["payments"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for idx in _batches(max(events - have_events, 0), batch_size):
+            shifted = range(idx.start + have_events, idx.stop + have_events)
+            s.execute(insert(WebhookEvent), _event_rows(shifted, now, days, rnd))
+            s.commit()
+        timings["events"] = time.perf_counter() - t0
+
+        counts = {
+            "users": s.scalar(select(func.count()).select_from(User)),
+            "payments": s.scalar(select(func.count()).select_from(Payment)),
+            "webhook_events": s.scalar(select(func.count()).select_from(WebhookEvent)),
+        }
+    return {"counts": counts, "seconds": {k: round(v, 3) for k, v in timings.items()}}
+
+
+def main(argv: List[str] | None = None) -> None:
+    p = argparse.ArgumentParser(description="Seed a CoursePay benchmark database")
+    p.add_argument("--db", default="bench/bench.db", help="SQLite 檔案路徑或完整 DATABASE_URL")
+    p.add_argument("--payments", type=int, default=10_000)
+    p.add_argument("--events", type=int, default=10_000)
+    p.add_argument("--users", type=int, default=1_000)
+    p.add_argument("--days", type=int, default=365, help="created_at 分布的天數")
+    p.add_argument("--batch-size", type=int, default=10_000)
+    args = p.parse_args(argv)
+
+    print(json.dumps(seed(
+        db_url(args.db), args.payments, args.events, args.users, args.days, args.batch_size,
+    ), indent=2))
+
+
+def db_url(db: str) -> str:
+    if "://" in db:
+        return db
+    return f"sqlite:///{Path(db).expanduser().resolve().as_posix()}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# blueprints/admin/api.py
+from __future__ import annotations
+
+import hashlib
+import hmac
+from datetime import datetime
+from typing import Any, Dict, List
+
+from flask import current_app, jsonify, request
+from sqlalchemy import and_, desc, func, select
+
+from . import bp
+from .routes import parse_date_range, payment_filters, read_list_args
+from services import partitions
+from services.db import get_read_session
+from services.models import Payment
+
+# 可投影的欄位（白名單）；未指定 fields 時回傳全部
+PAYMENT_FIELDS = {
+    "id": Payment.id,
+    "stripe_session_id": Payment.stripe_session_id,
+    "course_id": Payment.course_id,
+    "amount_twd": Payment.amount_twd,
+    "status": Payment.status,
+    "buyer_email": Payment.buyer_email,
+    "user_id": Payment.user_id,
+    "stripe_payment_intent_id": Payment.stripe_payment_intent_id,
+    "created_at": Payment.created_at,
+    "updated_at": Payment.updated_at,
+}
+
+MAX_LOOKUP_IDS = 1000
+_IN_CHUNK = 500
+
+
+@bp.before_request
+def _require_api_token():
+    """
+    /admin/api/* 會批次輸出買家 email / user_id，必須帶 X-Admin-Token（對應 ADMIN_API_TOKEN）。
+    未設定 token 時整個 API 停用（403）；HTML 後台頁面不受影響。
+    """
+    if not request.path.startswith(f"{bp.url_prefix}/api/"):
+        return None
+    token = current_app.config.get("ADMIN_API_TOKEN") or ""
+    if not token:
+        return jsonify({"ok": False, "error": "admin API disabled (ADMIN_API_TOKEN not set)"}), 403
+    header = request.headers.get("X-Admin-Token") or ""
+    if not hmac.compare_digest(header.encode("utf-8"), token.encode("utf-8")):
+        return jsonify({"ok": False, "error": "invalid or missing X-Admin-Token"}), 401
+    return None
+
+
+def _parse_fields(raw) -> List[str]:
+    """fields=a,b,c（或 JSON list of str）→ 驗證後的欄位清單；型別或欄位名稱不合法時丟 ValueError（回 400）"""
+    if not raw:
+        return list(PAYMENT_FIELDS)
+    if isinstance(raw, str):
+        names = [f.strip() for f in raw.split(",")]
+    elif isinstance(raw, list) and all(isinstance(f, str) for f in raw):
+        names = raw
+    else:
+        raise ValueError("fields must be a string or a list of strings")
+    names = [n for n in names if n]
+    unknown = [n for n in names if n not in PAYMENT_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return names or list(PAYMENT_FIELDS)
+
+
+def _row_to_dict(names: List[str], row) -> Dict[str, Any]:
+    out = {}
+    for name, value in zip(names, row):
+        out[name] = value.isoformat() if isinstance(value, datetime) else value
+    return out
+
+
+def _high_water_etag(s) -> str:
+    """
+    以 payments 的高水位（max(id)、max(updated_at)）加上請求參數產生 ETag。
+    兩個聚合都走索引，遠比實際查詢便宜；資料沒變時直接回 304。
+    封存分區的資料不會被更新（更新前會搬回熱表），因此只需另外納入分區配置。
+    """
+    max_id, max_updated = s.execute(
+        select(func.max(Payment.id), func.max(Payment.updated_at))
+    ).one()
+    layout = partitions.layout_key(s)
+    basis = f"{max_id}|{max_updated}|{layout}|{request.full_path}".encode("utf-8")
+    return hashlib.sha1(basis).hexdigest()
+
+
+@bp.get("/api/payments")
+def api_payments():
+    """
+    付款清單 JSON API（只讀；需 X-Admin-Token）
+    參數：與 /admin/payments 相同（q / date_from / date_to / page / page_size），另有
+      - fields: 要回傳的欄位，逗號分隔（例：fields=stripe_session_id,status）
+      - session_id: 可重複，批次查詢指定的 Stripe session（忽略分頁）
+    回應帶 ETag；帶 If-None-Match 且資料未變更時回 304。
+    """
+    try:
+        names = _parse_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    session_ids = [sid for sid in request.args.getlist("session_id") if sid]
+    if len(session_ids) > MAX_LOOKUP_IDS:
+        return jsonify({"ok": False, "error": f"too many session_id (max {MAX_LOOKUP_IDS})"}), 400
+
+    with get_read_session() as s:
+        etag = _high_water_etag(s)
+        if request.if_none_match.contains(etag):
+            resp = current_app.response_class(status=304)
+            resp.set_etag(etag)
+            return resp
+
+        if session_ids:
+            body = {"ok": True, "items": _lookup(s, names, session_ids)}
+        else:
+            body = _page(s, names)
+
+    resp = jsonify(body)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+@bp.post("/api/payments/lookup")
+def api_payments_lookup():
+    """
+    批次查詢：POST JSON {"session_ids": [...], "fields": [...]}（最多 1000 筆；需 X-Admin-Token）
+    回傳 {"items": [...], "missing": [...]}（missing 為查無資料的 session id）
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "error": "body must be a JSON object"}), 400
+    raw_ids = data.get("session_ids")
+    if not isinstance(raw_ids, list) or not all(isinstance(sid, str) for sid in raw_ids):
+        return jsonify({"ok": False, "error": "session_ids must be a list of strings"}), 400
+    session_ids = [sid for sid in raw_ids if sid]
+    if not session_ids:
+        return jsonify({"ok": False, "error": "missing session_ids"}), 400
+    if len(session_ids) > MAX_LOOKUP_IDS:
+        return jsonify({"ok": False, "error": f"too many session_ids (max {MAX_LOOKUP_IDS})"}), 400
+    try:
+        names = _parse_fields(data.get("fields"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    # 需要 stripe_session_id 才能算出 missing；未要求時只在內部使用
+    query_names = names if "stripe_session_id" in names else names + ["stripe_session_id"]
+    with get_read_session() as s:
+        items = _lookup(s, query_names, session_ids)
+
+    found = {it["stripe_session_id"] for it in items}
+    if query_names is not names:
+        for it in items:
+            it.pop("stripe_session_id", None)
+    return jsonify({
+        "ok": True,
+        "items": items,
+        "missing": [sid for sid in dict.fromkeys(session_ids) if sid not in found],
+    })
+
+
+def _lookup(s, names: List[str], session_ids: List[str]) -> List[Dict[str, Any]]:
+    """以 stripe_session_id IN (...) 分塊查詢，只取指定欄位（不建立 ORM 物件）"""
+    P = partitions.payments_source(s)  # 不知道 session 的日期：查所有分區
+    cols = [getattr(P, n) for n in names]
+    unique = list(dict.fromkeys(session_ids))
+    items: List[Dict[str, Any]] = []
+    for i in range(0, len(unique), _IN_CHUNK):
+        chunk = unique[i:i + _IN_CHUNK]
+        rows = s.execute(select(*cols).where(P.stripe_session_id.in_(chunk)))
+        items.extend(_row_to_dict(names, row) for row in rows)
+    return items
+
+
+def _page(s, names: List[str]) -> Dict[str, Any]:
+    args = read_list_args()
+    page, page_size = args["page"], args["page_size"]
+    offset = (page - 1) * page_size
+
+    # 只掃與日期範圍重疊的分區
+    P = partitions.payments_source(s, *parse_date_range(args["date_from"], args["date_to"]))
+    conds = payment_filters(args["q"], args["date_from"], args["date_to"], model=P)
+    where = and_(*conds) if conds else None
+
+    stmt = select(*[getattr(P, n) for n in names])
+    count_stmt = select(func.count()).select_from(P)
+    if where is not None:
+        stmt = stmt.where(where)
+        count_stmt = count_stmt.where(where)
+    stmt = stmt.order_by(desc(P.created_at)).offset(offset).limit(page_size)
+
+    total = s.scalar(count_stmt) or 0
+    items = [_row_to_dict(names, row) for row in s.execute(stmt)]
+    return {
+        "ok": True,
+        "items": items,
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "has_prev": page > 1,
+        "has_next": (offset + len(items)) < total,
+    }
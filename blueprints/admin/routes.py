@@ -4,7 +4,8 @@ from __future__ import annotations
 from flask import jsonify, request, render_template
 from . import bp
 
-from services.db import get_session
+from services import partitions
+from services.db import get_read_session
 from services.models import Payment
 from sqlalchemy import desc, and_
 from datetime import datetime, timedelta
@@ -15,18 +16,29 @@ def ping():
     return jsonify({"module": "admin", "ok": True})
 
 
-@bp.get("/payments")
-def payments_list():
-    """
-    付款清單（只讀）+ 搜尋 / 日期篩選 / 分頁
-    參數：
-      - q: 同時模糊比對 course_id / buyer_email
-      - date_from: YYYY-MM-DD（含當日 00:00）
-      - date_to:   YYYY-MM-DD（含當日 23:59）
-      - page: 頁碼（>=1）
-      - page_size: 每頁筆數（1~100）
-    """
-    # --- 讀取查詢參數 ---
+@bp.get("/db/replica")
+def replica_status():
+    """唯讀 Engine 狀態（是否設定、健康、延遲秒數）"""
+    from services.db import replica_status as _status
+    return jsonify(_status())
+
+
+@bp.get("/outbox/stats")
+def outbox_stats():
+    """Outbox 佇列狀態（JSON）：pending/done/dead 筆數與最舊待處理訊息的延遲"""
+    from services.outbox import queue_stats
+    return jsonify(queue_stats())
+
+
+@bp.get("/metrics/latency")
+def latency_metrics():
+    """各路由延遲直方圖（JSON）：total 與 db / stripe / template / python 分段"""
+    from services.profiling import snapshot
+    return jsonify(snapshot())
+
+
+def read_list_args() -> dict:
+    """讀取清單類查詢參數（HTML 清單與 JSON API 共用）"""
     q = (request.args.get("q") or "").strip()
     date_from = (request.args.get("date_from") or "").strip()
     date_to = (request.args.get("date_to") or "").strip()
@@ -42,38 +54,73 @@ def payments_list():
     except ValueError:
         page_size = 20
 
+    return {"q": q, "date_from": date_from, "date_to": date_to, "page": page, "page_size": page_size}
+
+
+def parse_date_range(date_from: str, date_to: str) -> tuple:
+    """YYYY-MM-DD 字串 → [dt_from, dt_to)（含 date_to 當日）；空白或格式錯誤為 None"""
+    dt_from = dt_to = None
+    if date_from:
+        try:
+            dt_from = datetime.strptime(date_from, "%Y-%m-%d")
+        except ValueError:
+            pass
+    if date_to:
+        try:
+            # 讓 date_to 含當日：+1 天再用 < 上界
+            dt_to = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
+        except ValueError:
+            pass
+    return dt_from, dt_to
+
+
+def payment_filters(q: str, date_from: str, date_to: str, model=Payment) -> list:
+    """
+    把搜尋 / 日期參數轉成 WHERE 條件（可用於 Query.filter 或 select().where）
+    model 可傳入 partitions.payments_source() 回傳的分區別名
+    """
+    conds = []
+
+    # 文字搜尋：course_id / buyer_email
+    if q:
+        like = f"%{q}%"
+        conds.append((model.course_id.ilike(like)) | (model.buyer_email.ilike(like)))
+
+    # 日期範圍（含當日）
+    dt_from, dt_to = parse_date_range(date_from, date_to)
+    if dt_from is not None:
+        conds.append(model.created_at >= dt_from)
+    if dt_to is not None:
+        conds.append(model.created_at < dt_to)
+    return conds
+
+
+@bp.get("/payments")
+def payments_list():
+    """
+    付款清單（只讀）+ 搜尋 / 日期篩選 / 分頁
+    參數：
+      - q: 同時模糊比對 course_id / buyer_email
+      - date_from: YYYY-MM-DD（含當日 00:00）
+      - date_to:   YYYY-MM-DD（含當日 23:59）
+      - page: 頁碼（>=1）
+      - page_size: 每頁筆數（1~100）
+    """
+    # --- 讀取查詢參數 ---
+    args = read_list_args()
+    q, date_from, date_to = args["q"], args["date_from"], args["date_to"]
+    page, page_size = args["page"], args["page_size"]
     offset = (page - 1) * page_size
 
-    # --- 組合查詢 ---
-    with get_session() as s:
-        query = s.query(Payment)
-
-        # 文字搜尋：course_id / buyer_email
-        if q:
-            like = f"%{q}%"
-            query = query.filter(
-                (Payment.course_id.ilike(like)) | (Payment.buyer_email.ilike(like))
-            )
-
-        # 日期範圍（含當日）
-        conds = []
-        if date_from:
-            try:
-                dt_from = datetime.strptime(date_from, "%Y-%m-%d")
-                conds.append(Payment.created_at >= dt_from)
-            except ValueError:
-                pass
-        if date_to:
-            try:
-                # 讓 date_to 含當日：+1 天再用 < 上界
-                dt_to = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
-                conds.append(Payment.created_at < dt_to)
-            except ValueError:
-                pass
+    # --- 組合查詢（只掃與日期範圍重疊的分區）---
+    with get_read_session() as s:
+        P = partitions.payments_source(s, *parse_date_range(date_from, date_to))
+        query = s.query(P)
+        conds = payment_filters(q, date_from, date_to, model=P)
         if conds:
             query = query.filter(and_(*conds))
 
-        query = query.order_by(desc(Payment.created_at))
+        query = query.order_by(desc(P.created_at))
         total = query.count()
         rows = query.offset(offset).limit(page_size).all()
 
@@ -1,24 +1,44 @@
 # blueprints/billing/routes.py
 from __future__ import annotations
 
+import time
+
 import stripe
 from flask import jsonify, request, current_app, redirect, url_for, render_template
+from flask import session as flask_session
+from flask_login import current_user
 from jinja2 import TemplateNotFound
 from . import bp
 from models import catalog
 
 from services.db import get_session
 from services.models import Payment, WebhookEvent
+from services import circuit, entitlements, jsoncodec, webhooks
+from services.profiling import span
 
 # 建議固定 API 版本（若專案有集中設定可移除此行）
 stripe.api_version = "2024-10-28.acacia"
 
 # ---- 不直接 from stripe.error 匯入，動態抓取避免 Pylance 報錯 ----
 _stripe_error = getattr(stripe, "error", None)
-SignatureVerificationError = getattr(_stripe_error, "SignatureVerificationError", Exception)
-StripeError = getattr(_stripe_error, "StripeError", Exception)
+# stripe>=8 起例外類別改放在頂層（stripe.error 已移除），兩處都找
+SignatureVerificationError = (
+    getattr(_stripe_error, "SignatureVerificationError", None)
+    or getattr(stripe, "SignatureVerificationError", Exception)
+)
+StripeError = getattr(_stripe_error, "StripeError", None) or getattr(stripe, "StripeError", Exception)
+# 只有連線失敗 / Stripe 端錯誤算「服務故障」（卡片被拒、參數錯誤不算）
+_STRIPE_OUTAGE_ERRORS = tuple(
+    cls for cls in (
+        getattr(_stripe_error, "APIConnectionError", None) or getattr(stripe, "APIConnectionError", None),
+        getattr(_stripe_error, "APIError", None) or getattr(stripe, "APIError", None),
+    ) if cls is not None
+)
 # -----------------------------------------------------------------------
 
+# 連續失敗時快速回 503，不讓每個結帳請求都卡到逾時（門檻由 init_health 依設定調整）
+stripe_breaker = circuit.breaker("stripe", trips_on=_STRIPE_OUTAGE_ERRORS)
+
 
 @bp.get("/ping")
 def ping():
@@ -66,27 +86,35 @@ def checkout_create():
     # ===== 真正 Stripe 流程 =====
     stripe.api_key = current_app.config["STRIPE_API_KEY"]
 
+    # 已登入時帶上 user_id，讓 Webhook 可以把付款綁到使用者（權限查詢用）
+    metadata = {"course_id": course_id}
+    if current_user.is_authenticated:
+        metadata["user_id"] = str(current_user.id)
+
     success_url = url_for("billing.checkout_success", _external=True) + "?session_id={CHECKOUT_SESSION_ID}"
     cancel_url = url_for("billing.checkout_cancel", _external=True)
 
     try:
-        session = stripe.checkout.Session.create(
-            mode="payment",
-            success_url=success_url,
-            cancel_url=cancel_url,
-            line_items=[{
-                "quantity": 1,
-                "price_data": {
-                    "currency": "twd",
-                    "unit_amount": int(course["price_twd"]) * 100,  # 以 catalog 為準（單位：分）
-                    "product_data": {
-                        "name": course["title"],
-                        "metadata": {"course_id": course_id},
+        with span("stripe"), stripe_breaker.guard():
+            session = stripe.checkout.Session.create(
+                mode="payment",
+                success_url=success_url,
+                cancel_url=cancel_url,
+                line_items=[{
+                    "quantity": 1,
+                    "price_data": {
+                        "currency": "twd",
+                        "unit_amount": int(course["price_twd"]) * 100,  # 以 catalog 為準（單位：分）
+                        "product_data": {
+                            "name": course["title"],
+                            "metadata": {"course_id": course_id},
+                        },
                     },
-                },
-            }],
-            metadata={"course_id": course_id},
-        )
+                }],
+                metadata=metadata,
+            )
+    except circuit.CircuitOpenError:
+        return jsonify({"ok": False, "error": "payment provider unavailable, please retry later"}), 503
     except StripeError as e:  # 先攔 Stripe 相關錯誤
         user_msg = getattr(e, "user_message", None)
         return jsonify({"ok": False, "error": f"stripe error: {user_msg or str(e)}"}), 400
@@ -113,13 +141,20 @@ def checkout_success():
     session_id = request.args.get("session_id")
     summary = None
 
+    # 付款可能由其他 worker 的 webhook 寫入：清掉本行程快取，並讓接下來一段時間的課程頁
+    # 不論由哪個 worker 處理都略過快取（避免仍顯示「購買」而重複付款）
+    if current_user.is_authenticated:
+        entitlements.invalidate(current_user.id)
+        flask_session[entitlements.REFRESH_SESSION_KEY] = time.time() + entitlements.REFRESH_AFTER_CHECKOUT_SECONDS
+
     if session_id and current_app.config.get("STRIPE_API_KEY"):
         stripe.api_key = current_app.config["STRIPE_API_KEY"]
         try:
-            sess = stripe.checkout.Session.retrieve(
-                session_id,
-                expand=["customer_details", "payment_intent"],
-            )
+            with span("stripe"), stripe_breaker.guard():
+                sess = stripe.checkout.Session.retrieve(
+                    session_id,
+                    expand=["customer_details", "payment_intent"],
+                )
             summary = {
                 "session_id": sess.get("id"),
                 "status": sess.get("payment_status"),
@@ -157,8 +192,9 @@ def checkout_cancel():
 @bp.post("/webhook")
 def webhook():
     """
-    Stripe Webhook：驗簽 → 記錄事件（webhook_events）→
-    若為 checkout.session.completed，則寫入/更新 payments。
+    Stripe Webhook：驗簽 →（不處理的類型依政策提早丟棄）→ 記錄事件（webhook_events）→
+    依事件類型分派：checkout.session.completed / expired / async_payment_succeeded /
+    async_payment_failed、charge.refunded 會寫入或更新 payments。
     本地測試方式：
       1) stripe login
       2) stripe listen --forward-to http://localhost:5000/billing/webhook
@@ -174,11 +210,14 @@ def webhook():
     sig_header = request.headers.get("Stripe-Signature", "")
 
     # --- 驗簽 ---
+    # 只驗證簽章，再用 jsoncodec 解析一次成 dict；不經 construct_event 的
+    # json.loads + StripeObject 轉換，原始 bytes 也直接存入 webhook_events。
     try:
-        event = stripe.Webhook.construct_event(
-            payload=payload,
-            sig_header=sig_header,
-            secret=secret,
+        stripe.WebhookSignature.verify_header(
+            payload.decode("utf-8"),
+            sig_header,
+            secret,
+            tolerance=stripe.Webhook.DEFAULT_TOLERANCE,
         )
     except SignatureVerificationError:
         return jsonify({"ok": False, "error": "invalid signature"}), 400
@@ -187,17 +226,33 @@ def webhook():
     except Exception as e:
         return jsonify({"ok": False, "error": f"bad payload: {e}"}), 400
 
-    # --- 通用：將原始事件冪等寫入 webhook_events（便於審計/重放/對帳） ---
+    # --- 不處理的事件類型：依政策在解析前直接丟棄（不碰 DB） ---
+    policy = current_app.config.get("WEBHOOK_IGNORED_POLICY", "store")
+    if webhooks.should_drop_early(
+        payload, policy, current_app.config.get("WEBHOOK_IGNORED_SAMPLE_RATE", 0.0)
+    ):
+        return jsonify({"ok": True, "ignored": True}), 200
+
+    try:
+        event = jsoncodec.loads(payload)
+        if not isinstance(event, dict):
+            raise ValueError("event is not a JSON object")
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"bad payload: {e}"}), 400
+
     etype = event.get("type", "")
     data_obj = (event.get("data") or {}).get("object") or {}
     eid = event.get("id")
+    handler = webhooks.get_handler(etype)
 
+    # --- 通用：將原始事件冪等寫入 webhook_events（便於審計/重放/對帳） ---
+    # 不處理的類型在 sample 政策下走到這裡，代表已被抽中，照常寫入
     try:
         with get_session() as s:
             if eid:
                 exists = s.query(WebhookEvent).filter_by(event_id=eid).first()
                 if not exists:
-                    s.add(WebhookEvent(event_id=eid, type=etype, payload=event))
+                    s.add(WebhookEvent(event_id=eid, type=etype, payload=jsoncodec.Raw(payload)))
                     s.commit()
     except Exception as e:
         current_app.logger.exception(f"[webhook] save event failed: {e}")
@@ -205,44 +260,18 @@ def webhook():
         # （若你希望 Stripe 重試，可改回 500）
         return jsonify({"ok": False, "warning": "event log failed but ignored"}), 200
 
-    # --- 針對 checkout.session.completed：寫/更新 payments ---
-    if etype == "checkout.session.completed":
-        session_id = data_obj.get("id") or ""
-        meta = data_obj.get("metadata") or {}
-        course_id = meta.get("course_id") or "unknown"
-        amount_total = data_obj.get("amount_total")  # 單位：分
-        status = data_obj.get("payment_status")      # "paid" / ...
-        email = (data_obj.get("customer_details") or {}).get("email")
-
-        try:
-            with get_session() as s:
-                pay = s.query(Payment).filter_by(stripe_session_id=session_id).first()
-                amount_twd = int((amount_total or 0) / 100)  # 轉成「元」
-
-                if not pay:
-                    pay = Payment(
-                        stripe_session_id=session_id,
-                        course_id=course_id,
-                        amount_twd=amount_twd,
-                        status="paid" if status == "paid" else (status or "unknown"),
-                        buyer_email=email,
-                    )
-                    s.add(pay)
-                else:
-                    # Stripe 可能重送事件：僅更新狀態，不新增
-                    pay.status = "paid" if status == "paid" else (status or pay.status)
-                s.commit()
-
-            current_app.logger.info(
-                f"[webhook] checkout.completed stored: session={session_id} "
-                f"course_id={course_id} amount_twd={int((amount_total or 0)/100)} status={status}"
-            )
-        except Exception as e:
-            current_app.logger.exception(f"[webhook] save payment failed: {e}")
-            # 同上：避免 Stripe 無限重試；若你想要重試，改回 500。
-            return jsonify({"ok": False, "warning": "payment save failed but ignored"}), 200
-    else:
+    # --- 依事件類型分派（services/webhooks.py 註冊的 handler） ---
+    if handler is None:
         current_app.logger.info(f"[webhook] received event: {etype}")
+        return jsonify({"ok": True}), 200
+
+    try:
+        with get_session() as s:
+            handler(s, data_obj, event)
+    except Exception as e:
+        current_app.logger.exception(f"[webhook] handle {etype} failed: {e}")
+        # 同上：避免 Stripe 無限重試；若你想要重試，改回 500。
+        return jsonify({"ok": False, "warning": "event handling failed but ignored"}), 200
 
     # 正常完成
     return jsonify({"ok": True}), 200
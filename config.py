@@ -13,6 +13,57 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///coursepay.db")
     SQLALCHEMY_ECHO = os.getenv("SQLALCHEMY_ECHO", "0") == "1"
 
+    # 讀寫分離：後台/報表查詢走唯讀 Engine
+    # - READ_DATABASE_URL：replica 連線字串；未設定且主庫為 SQLite 檔案時，以唯讀模式開同一檔案
+    # - SQLITE_WAL：SQLite 改用 WAL，讀取與 webhook 寫入互不阻塞
+    READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", "")
+    READ_REPLICA_ENABLED = os.getenv("READ_REPLICA_ENABLED", "1") == "1"
+    READ_REPLICA_MAX_LAG_SECONDS = float(os.getenv("READ_REPLICA_MAX_LAG_SECONDS", "5") or 5)
+    SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+
+    # payments 月份分區（flask partitions rotate / detach）
+    # - PAYMENTS_HOT_MONTHS：SQLite 熱表保留的月數（含本月），更早的月份搬到 payments_YYYYMM
+    # - PAYMENTS_PREMAKE_MONTHS：PostgreSQL 預先建立的未來月份分區數
+    # - PAYMENTS_COLD_DIR：detach 匯出檔目錄（預設 instance/cold）
+    PAYMENTS_HOT_MONTHS = int(os.getenv("PAYMENTS_HOT_MONTHS", "3") or 3)
+    PAYMENTS_PREMAKE_MONTHS = int(os.getenv("PAYMENTS_PREMAKE_MONTHS", "2") or 2)
+    PAYMENTS_COLD_DIR = os.getenv("PAYMENTS_COLD_DIR", "")
+
     # Stripe
     STRIPE_API_KEY = os.getenv("STRIPE_API_KEY", "")
     STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+    # 可指向本地 stripe-mock（例：http://localhost:12111），對帳/測試用
+    STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "")
+
+    # Webhook 不處理的事件類型：store（照舊寫入）/ sample（抽樣寫入）/ drop（解析前直接丟棄）
+    WEBHOOK_IGNORED_POLICY = os.getenv("WEBHOOK_IGNORED_POLICY", "store")
+    WEBHOOK_IGNORED_SAMPLE_RATE = float(os.getenv("WEBHOOK_IGNORED_SAMPLE_RATE", "0.01") or 0)
+
+    # Profiling：延遲直方圖（預設開）與按需取樣 profiler（預設關）
+    LATENCY_HISTOGRAMS = os.getenv("LATENCY_HISTOGRAMS", "1") == "1"
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")  # 請求帶 X-Profile: <token> 觸發
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0") or 0)  # 0~1
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5") or 5)
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "")  # 預設 instance/profiles
+
+    # 健康檢查：依賴檢查結果快取秒數 / 單次檢查逾時 / outbox 延遲上限（超過視為 degraded）
+    HEALTH_CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", "2") or 2)
+    HEALTH_PROBE_TIMEOUT_SECONDS = float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "2") or 2)
+    HEALTH_OUTBOX_MAX_LAG_SECONDS = float(os.getenv("HEALTH_OUTBOX_MAX_LAG_SECONDS", "300") or 300)
+
+    # SIGTERM drain：readiness 先回 503，GRACE 秒後拒絕新請求，最多等 TIMEOUT 秒讓進行中請求完成
+    # （gunicorn 的 graceful_timeout 需大於兩者相加）
+    DRAIN_ON_SIGTERM = os.getenv("DRAIN_ON_SIGTERM", "1") == "1"
+    DRAIN_GRACE_SECONDS = float(os.getenv("DRAIN_GRACE_SECONDS", "5") or 5)
+    DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "25") or 25)
+
+    # 後台 JSON API（/admin/api/*，含買家 email）：請求需帶 X-Admin-Token: <token>；未設定時 API 停用
+    ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+    # Stripe circuit breaker：連續失敗次數門檻 / 斷路後多久放行試探請求
+    STRIPE_CIRCUIT_FAILURES = int(os.getenv("STRIPE_CIRCUIT_FAILURES", "5") or 5)
+    STRIPE_CIRCUIT_RESET_SECONDS = float(os.getenv("STRIPE_CIRCUIT_RESET_SECONDS", "30") or 30)
+
+    # Jinja bytecode 快取目錄（多 worker 共用；"off" 停用）與啟動時預先編譯
+    TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "")  # 預設 instance/jinja_cache
+    TEMPLATE_WARMUP = os.getenv("TEMPLATE_WARMUP", "1") == "1"
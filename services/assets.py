@@ -0,0 +1,167 @@
+# services/assets.py
+"""
+靜態檔案建置：內容雜湊檔名 + 預先壓縮（gzip / brotli）+ manifest。
+
+    flask assets build
+      static/styles.css -> static/dist/styles.3f2a9c1b7d4e.css
+                           static/dist/styles.3f2a9c1b7d4e.css.gz
+                           static/dist/styles.3f2a9c1b7d4e.css.br（有安裝 brotli 才產生）
+      static/dist/manifest.json {"styles.css": "styles.3f2a9c1b7d4e.css", ...}
+
+- 模板以 asset_url("styles.css") 取得雜湊後的網址；尚未 build 時退回一般 /static/ 網址。
+- /assets/<檔名> 依 Accept-Encoding 回傳預壓縮版本，並加上一年、immutable 的快取標頭；
+  檔名隨內容改變，瀏覽器重複造訪時完全不需再下載。
+- 重新 build 不清空 dist/：新檔寫在舊檔旁邊，manifest.json 以 os.replace 原子替換；
+  最近 keep 代 manifest（manifest-history.json）引用的檔案都保留，
+  仍持有舊 manifest 的 worker（非 debug 模式只在啟動時讀一次）與快取舊 HTML 的瀏覽器不會拿到 404。
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, abort, request, send_file, url_for
+
+try:  # 選用套件：pip install brotli
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+    brotli = None
+
+DIST_DIRNAME = "dist"
+MANIFEST_NAME = "manifest.json"
+HISTORY_NAME = "manifest-history.json"
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt", ".html", ".map")
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _hashed_name(rel: Path, digest: str) -> str:
+    return rel.with_name(f"{rel.stem}.{digest}{rel.suffix}").as_posix()
+
+
+def _write_json(path: Path, data: Any) -> None:
+    """寫到暫存檔再 os.replace：讀取端不會讀到寫一半的 JSON。"""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _load_history(dist: Path) -> List[Dict[str, str]]:
+    """歷代 manifest（舊到新）；升級前的 dist 只有 manifest.json，視為上一代。"""
+    path = dist / HISTORY_NAME
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    current = dist / MANIFEST_NAME
+    return [json.loads(current.read_text(encoding="utf-8"))] if current.exists() else []
+
+
+def _prune(dist: Path, history: List[Dict[str, str]]) -> List[str]:
+    """刪除歷代 manifest 都沒有引用的檔案（含 .gz / .br）與空目錄；回傳刪除的相對路徑。"""
+    live = {MANIFEST_NAME, HISTORY_NAME}
+    for manifest in history:
+        for hashed in manifest.values():
+            live.update((hashed, f"{hashed}.gz", f"{hashed}.br"))
+    removed = []
+    for path in sorted(dist.rglob("*"), reverse=True):  # 子目錄內的檔案先於目錄本身
+        rel = path.relative_to(dist).as_posix()
+        if path.is_file() and rel not in live:
+            path.unlink()
+            removed.append(rel)
+        elif path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+    return sorted(removed)
+
+
+def build_assets(static_dir: str | Path, hash_len: int = 12, keep: int = 3) -> Dict[str, str]:
+    """
+    將 static/ 下的檔案（dist/ 除外）複製為內容雜湊檔名並預先壓縮，寫出 manifest。
+    舊版檔案保留到不在最近 keep 代 manifest（含本次）中才刪除。
+    回傳 manifest（原始相對路徑 -> dist 內的雜湊檔名）。
+    """
+    static_dir = Path(static_dir)
+    dist = static_dir / DIST_DIRNAME
+    dist.mkdir(parents=True, exist_ok=True)
+
+    manifest: Dict[str, str] = {}
+    for src in sorted(static_dir.rglob("*")):
+        if not src.is_file() or dist in src.parents:
+            continue
+        rel = src.relative_to(static_dir)
+        data = src.read_bytes()
+        hashed = _hashed_name(rel, hashlib.sha256(data).hexdigest()[:hash_len])
+        out = dist / hashed
+        out.parent.mkdir(parents=True, exist_ok=True)
+        # 同名即同內容：已存在的檔案（可能正被讀取）不重寫
+        if not out.exists():
+            out.write_bytes(data)
+
+        if src.suffix.lower() in COMPRESSIBLE:
+            gz, br = Path(f"{out}.gz"), Path(f"{out}.br")
+            if not gz.exists():
+                # mtime=0：相同內容產生相同的 .gz（可重現建置）
+                gz.write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None and not br.exists():
+                br.write_bytes(brotli.compress(data, quality=11))
+        manifest[rel.as_posix()] = hashed
+
+    history = (_load_history(dist) + [manifest])[-max(keep, 1):]
+    _write_json(dist / MANIFEST_NAME, manifest)
+    _write_json(dist / HISTORY_NAME, history)
+    _prune(dist, history)
+    return manifest
+
+
+def load_manifest(static_dir: str | Path) -> Dict[str, str]:
+    path = Path(static_dir) / DIST_DIRNAME / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _pick_encoding(path: Path) -> tuple[Path, Optional[str]]:
+    accept = request.headers.get("Accept-Encoding", "")
+    if "br" in accept and Path(f"{path}.br").is_file():
+        return Path(f"{path}.br"), "br"
+    if "gzip" in accept and Path(f"{path}.gz").is_file():
+        return Path(f"{path}.gz"), "gzip"
+    return path, None
+
+
+def init_assets(app: Flask) -> None:
+    """註冊 asset_url() 模板函式與 /assets/<filename> 路由。"""
+    static_dir = Path(app.static_folder or "static")
+    dist = (static_dir / DIST_DIRNAME).resolve()
+    state = {"manifest": load_manifest(static_dir)}
+
+    def asset_url(filename: str) -> str:
+        # 開發模式每次重讀，方便 build 後不用重啟
+        manifest = load_manifest(static_dir) if app.debug else state["manifest"]
+        hashed = manifest.get(filename)
+        if hashed:
+            return url_for("assets", filename=hashed)
+        return url_for("static", filename=filename)
+
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    @app.get("/assets/<path:filename>", endpoint="assets")
+    def serve_asset(filename: str):
+        path = (dist / filename).resolve()
+        if dist not in path.parents or not path.is_file() or filename in (MANIFEST_NAME, HISTORY_NAME):
+            abort(404)
+        chosen, encoding = _pick_encoding(path)
+        # mimetype 以原始副檔名判斷（不是 .gz / .br）
+        mimetype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        resp = send_file(chosen, mimetype=mimetype, conditional=True, max_age=31536000)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        resp.headers["Vary"] = "Accept-Encoding"
+        resp.headers["Cache-Control"] = CACHE_CONTROL_IMMUTABLE
+        return resp
+
+
+__all__ = ["build_assets", "init_assets", "load_manifest"]
@@ -0,0 +1,155 @@
+# services/circuit.py
+"""
+簡易 circuit breaker：外部服務（Stripe）連續失敗時先快速失敗，不讓每個請求都卡到逾時。
+
+    stripe_breaker = circuit.breaker("stripe", trips_on=(stripe.APIConnectionError,))
+    with stripe_breaker.guard():      # 斷路中 → 直接丟 CircuitOpenError
+        stripe.checkout.Session.create(...)
+
+狀態：closed（正常）→ 連續 failure_threshold 次失敗 → open（拒絕呼叫）
+     → reset_timeout 秒後 half_open（放行一個試探請求）→ 成功回 closed / 失敗回 open。
+只有 trips_on 內的例外算「服務故障」；卡片被拒、參數錯誤等不影響斷路狀態。
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple, Type
+
+log = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """斷路中，未實際呼叫外部服務。"""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        trips_on: Tuple[Type[BaseException], ...] = (Exception,),
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trips_on = trips_on
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.total_failures = 0
+        self.total_rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """是否可以呼叫；half_open 時只放行一個試探請求。"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.total_rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                log.info("[circuit] %s closed", self.name)
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self.total_failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    log.warning("[circuit] %s opened after %s failures", self.name, self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            yield
+        except self.trips_on:
+            self.record_failure()
+            raise
+        except BaseException:
+            # 非服務故障（例：卡片被拒）：服務本身有回應，視為成功
+            self.record_success()
+            raise
+        else:
+            self.record_success()
+
+    def as_dict(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            retry_in = None
+            if state == OPEN:
+                retry_in = round(max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0), 1)
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected,
+                "retry_in_seconds": retry_in,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def breaker(name: str, **options: Any) -> CircuitBreaker:
+    """取得（或建立）具名的 breaker；帶 options 時更新設定（例：由 app config 調整門檻）。"""
+    with _registry_lock:
+        b = _breakers.get(name)
+        if b is None:
+            b = _breakers[name] = CircuitBreaker(name, **options)
+        else:
+            for key, value in options.items():
+                setattr(b, key, value)
+        return b
+
+
+def get(name: str) -> Optional[CircuitBreaker]:
+    return _breakers.get(name)
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    return {name: b.as_dict() for name, b in list(_breakers.items())}
+
+
+__all__ = [
+    "CLOSED",
+    "HALF_OPEN",
+    "OPEN",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "breaker",
+    "get",
+    "snapshot",
+]
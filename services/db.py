@@ -1,11 +1,14 @@
 # services/db.py
 from __future__ import annotations
 
+import logging
 import os
+import threading
+import time
 from pathlib import Path
 from typing import Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
@@ -18,6 +21,12 @@ class Base(DeclarativeBase):
 _engine: Optional[Engine] = None
 _Session: Optional[sessionmaker] = None
 
+# 唯讀（報表）Engine；未設定時 get_read_session() 直接回主庫 Session
+_read_engine: Optional[Engine] = None
+_ReadSession: Optional[sessionmaker] = None
+
+log = logging.getLogger(__name__)
+
 
 # -----------------------------
 # URL & 路徑處理
@@ -58,16 +67,47 @@ def _resolve_database_url() -> str:
 # -----------------------------
 # 初始化與 Session 取得
 # -----------------------------
-def init_db(uri: Optional[str] = None, echo: bool = False) -> Engine:
+def _is_sqlite_file(engine: Engine) -> bool:
+    db = engine.url.database
+    return engine.dialect.name == "sqlite" and bool(db) and db != ":memory:" and not db.startswith("file:")
+
+
+def _enable_sqlite_wal(engine: Engine) -> None:
+    """WAL 模式：讀取者不會擋住寫入者（反之亦然）；journal_mode 會記錄在 DB 檔案內。"""
+
+    @event.listens_for(engine, "connect")
+    def _set_wal(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.close()
+
+
+def init_db(uri: Optional[str] = None, echo: bool = False, sqlite_wal: bool = False) -> Engine:
     """
     初始化 Engine 與 Session factory（整個 app 共用一次）。
     若 uri 為 None，會自動依環境解析。
+    sqlite_wal=True 時，SQLite 檔案改用 WAL 模式（搭配唯讀 Engine 使用）。
     """
-    global _engine, _Session
+    global _engine, _Session, _read_engine, _ReadSession
+
+    from services import jsoncodec
 
     uri = uri or _resolve_database_url()
-    _engine = create_engine(uri, echo=echo, future=True)
+    # JSON 欄位走 jsoncodec（orjson 可用時較快；Raw() 包裝的原始 JSON 直接寫入）
+    _engine = create_engine(
+        uri,
+        echo=echo,
+        future=True,
+        json_serializer=jsoncodec.dumps,
+        json_deserializer=jsoncodec.loads,
+    )
+    if sqlite_wal and _is_sqlite_file(_engine):
+        _enable_sqlite_wal(_engine)
     _Session = sessionmaker(bind=_engine, future=True, autoflush=False, autocommit=False)
+    # 主庫換了，舊的唯讀 Engine 不再適用
+    _read_engine, _ReadSession = None, None
+    _replica.reset()
     return _engine
 
 
@@ -110,6 +150,131 @@ def get_db_path() -> Optional[str]:
         return None
 
 
+# -----------------------------
+# 讀寫分離（報表 / 後台查詢走唯讀 Engine）
+# -----------------------------
+class _ReplicaState:
+    """唯讀 Engine 的健康與延遲狀態；每 check_interval 秒最多檢查一次。"""
+
+    def __init__(self) -> None:
+        self.max_lag = 5.0
+        self.check_interval = 2.0
+        self.cooldown = 30.0
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.healthy = True
+        self.lag: Optional[float] = None
+        self.checked_at = 0.0
+        self.down_until = 0.0
+
+    def usable(self, engine: Engine) -> bool:
+        now = time.monotonic()
+        if now < self.down_until:
+            return False
+        if now - self.checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self._check(engine, now)
+            finally:
+                self._lock.release()
+        return self.healthy and (self.lag is None or self.lag <= self.max_lag)
+
+    def _check(self, engine: Engine, now: float) -> None:
+        self.checked_at = now
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                self.lag = _replica_lag_seconds(conn)
+            self.healthy = True
+        except Exception as e:
+            log.warning("[db] read replica unavailable, falling back to primary: %s", e)
+            self.healthy = False
+            self.down_until = now + self.cooldown
+
+    def as_dict(self) -> dict:
+        return {
+            "configured": _read_engine is not None,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "max_lag_seconds": self.max_lag,
+        }
+
+
+_replica = _ReplicaState()
+
+
+def _replica_lag_seconds(conn) -> Optional[float]:
+    """PostgreSQL 串流複寫的回放延遲；SQLite（同一檔案）為 0，其他資料庫無法得知回 None。"""
+    name = conn.dialect.name
+    if name == "sqlite":
+        return 0.0
+    if name == "postgresql":
+        lag = conn.execute(text(
+            "SELECT CASE WHEN pg_is_in_recovery() "
+            "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+            "ELSE 0 END"
+        )).scalar()
+        return float(lag or 0.0)
+    return None
+
+
+def init_read_engine(
+    uri: Optional[str] = None,
+    echo: bool = False,
+    max_lag: float = 5.0,
+) -> Optional[Engine]:
+    """
+    建立唯讀 Engine：
+    - 有 uri（例：READ_DATABASE_URL 指向 PostgreSQL replica）→ 直接使用
+    - 否則主庫若為 SQLite 檔案 → 以 mode=ro 開同一個檔案（主庫需開 WAL，讀寫互不阻塞）
+    - 都不符合 → 不建立，get_read_session() 一律回主庫
+    """
+    global _read_engine, _ReadSession
+    from services import jsoncodec
+
+    assert _engine is not None, "DB not initialized; call init_db() first."
+    if not uri and _is_sqlite_file(_engine):
+        # file:///C:/x.db（Windows）或 file:///tmp/x.db（POSIX）
+        path = Path(_engine.url.database).resolve().as_posix().lstrip("/")
+        uri = f"sqlite:///file:///{path}?mode=ro&uri=true"
+    if not uri:
+        _read_engine, _ReadSession = None, None
+        return None
+
+    _read_engine = create_engine(
+        uri,
+        echo=echo,
+        future=True,
+        json_serializer=jsoncodec.dumps,
+        json_deserializer=jsoncodec.loads,
+    )
+    _ReadSession = sessionmaker(bind=_read_engine, future=True, autoflush=False, autocommit=False)
+    _replica.reset()
+    _replica.max_lag = max_lag
+    return _read_engine
+
+
+def get_read_session():
+    """
+    取得報表 / 後台查詢用的 Session（只讀）。
+    唯讀 Engine 未設定、無法連線或延遲超過 max_lag 時，自動改用主庫。
+        with get_read_session() as s:
+            ...
+    """
+    if _ReadSession is not None and _read_engine is not None and _replica.usable(_read_engine):
+        return _ReadSession()
+    return get_session()
+
+
+def get_read_engine() -> Optional[Engine]:
+    return _read_engine
+
+
+def replica_status() -> dict:
+    return _replica.as_dict()
+
+
 # -----------------------------
 # 建表
 # -----------------------------
@@ -119,3 +284,25 @@ def create_all() -> None:
     engine = get_engine()
     assert engine is not None, "DB engine not initialized. Call init_db() or init_from_env() first."
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns(engine)
+
+
+def _add_missing_columns(engine: Engine) -> None:
+    """
+    create_all() 不會替既有資料表補欄位與索引；專案沒有 migration 工具，
+    這裡對「可為 NULL 的新欄位」補上 ALTER TABLE ADD COLUMN，並補建缺少的索引。
+    """
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        missing = [c for c in table.columns if c.name not in have and c.nullable]
+        if missing:
+            with engine.begin() as conn:
+                for col in missing:
+                    coltype = col.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {coltype}'))
+        for idx in table.indexes:
+            idx.create(bind=engine, checkfirst=True)
@@ -0,0 +1,155 @@
+# services/entitlements.py
+"""
+使用者已購課程（entitlement）索引。
+
+- 每位使用者的已購課程以 frozenset 保存（小、不可變、查詢 O(1)）。
+- 行程內 LRU 快取；寫入 payments 時呼叫 invalidate(user_id) 讓快取失效。
+  多 worker 之間不共享快取，因此另有 TTL 作為上限；結帳剛完成的使用者
+  （付款由其他 worker 的 webhook 寫入）以 entitled_courses(uid, fresh=True) 略過快取，
+  見 REFRESH_AFTER_CHECKOUT_SECONDS。
+- has_entitlements() 一次查詢批次檢查多組 (user_id, course_id)（多位使用者的清單，例：後台 / 報表）；
+  課程頁只有目前使用者，直接用 entitled_courses()（順便填入快取）。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import select, tuple_
+
+from services import partitions
+from services.db import get_session
+
+# 視為「已購買」的付款狀態（部分退款仍保留課程權限）
+ENTITLED_STATUSES = ("paid", "partially_refunded")
+
+_CACHE_MAX_USERS = 10_000
+_CACHE_TTL_SECONDS = 60.0
+
+# 結帳完成後這段時間內略過快取直接查（涵蓋其他 worker 上可能還沒過期的舊快取）；
+# 到期時間存在 Flask session 的 REFRESH_SESSION_KEY（跨 worker 都看得到）
+REFRESH_AFTER_CHECKOUT_SECONDS = _CACHE_TTL_SECONDS
+REFRESH_SESSION_KEY = "entitlements_refresh_until"
+
+_lock = threading.Lock()
+# user_id -> (到期時間, 已購 course_id 集合)
+_cache: "OrderedDict[int, Tuple[float, FrozenSet[str]]]" = OrderedDict()
+
+
+def _cache_get(user_id: int) -> Optional[FrozenSet[str]]:
+    with _lock:
+        hit = _cache.get(user_id)
+        if hit is None:
+            return None
+        expires_at, courses = hit
+        if expires_at < time.monotonic():
+            del _cache[user_id]
+            return None
+        _cache.move_to_end(user_id)
+        return courses
+
+
+def _cache_put(user_id: int, courses: FrozenSet[str]) -> None:
+    with _lock:
+        _cache[user_id] = (time.monotonic() + _CACHE_TTL_SECONDS, courses)
+        _cache.move_to_end(user_id)
+        while len(_cache) > _CACHE_MAX_USERS:
+            _cache.popitem(last=False)
+
+
+def invalidate(user_id: Optional[int]) -> None:
+    """
+    付款寫入後呼叫，讓該使用者的快取失效。
+    user_id 為 None（未登入的訪客結帳）時什麼都不做：沒有人的權限因此改變，
+    不可因此清掉所有人的快取。需要全部清空請用 invalidate_all()。
+    """
+    if user_id is None:
+        return
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def invalidate_all() -> None:
+    """清空整個快取（例：移除整個月份分區後）。"""
+    with _lock:
+        _cache.clear()
+
+
+def _load_many(user_ids: Iterable[int]) -> Dict[int, FrozenSet[str]]:
+    """一次查詢載入多位使用者的已購課程（只取兩個欄位，不建立 ORM 物件）。"""
+    ids = list(set(user_ids))
+    found: Dict[int, Set[str]] = {uid: set() for uid in ids}
+    if not ids:
+        return {}
+    with get_session() as s:
+        P = partitions.payments_source(s)  # 權限不分年份：查所有分區
+        stmt = (
+            select(P.user_id, P.course_id)
+            .where(P.user_id.in_(ids))
+            .where(P.status.in_(ENTITLED_STATUSES))
+        )
+        for uid, course_id in s.execute(stmt):
+            found[uid].add(course_id)
+    return {uid: frozenset(courses) for uid, courses in found.items()}
+
+
+def entitled_courses(user_id: Optional[int], fresh: bool = False) -> FrozenSet[str]:
+    """
+    回傳該使用者已購買的 course_id 集合（未登入 / 無資料 → 空集合）。
+    fresh=True 時不讀快取，直接查詢並更新快取（剛結帳完成時使用）。
+    """
+    if user_id is None:
+        return frozenset()
+    cached = None if fresh else _cache_get(user_id)
+    if cached is not None:
+        return cached
+    courses = _load_many([user_id]).get(user_id, frozenset())
+    _cache_put(user_id, courses)
+    return courses
+
+
+def has_entitlement(user_id: Optional[int], course_id: str) -> bool:
+    return course_id in entitled_courses(user_id)
+
+
+def has_entitlements(pairs: Iterable[Tuple[int, str]]) -> Set[Tuple[int, str]]:
+    """
+    批次檢查多組 (user_id, course_id)，回傳「已購買」的那些組合。
+    已在快取的使用者直接判斷，其餘以單一查詢 (user_id, course_id) IN (...) 完成。
+    """
+    pairs = set(pairs)
+    owned: Set[Tuple[int, str]] = set()
+    pending: Set[Tuple[int, str]] = set()
+    for uid, course_id in pairs:
+        cached = _cache_get(uid)
+        if cached is None:
+            pending.add((uid, course_id))
+        elif course_id in cached:
+            owned.add((uid, course_id))
+
+    if pending:
+        with get_session() as s:
+            P = partitions.payments_source(s)
+            stmt = (
+                select(P.user_id, P.course_id)
+                .where(tuple_(P.user_id, P.course_id).in_(list(pending)))
+                .where(P.status.in_(ENTITLED_STATUSES))
+                .distinct()
+            )
+            owned.update((uid, cid) for uid, cid in s.execute(stmt))
+    return owned
+
+
+__all__ = [
+    "ENTITLED_STATUSES",
+    "REFRESH_AFTER_CHECKOUT_SECONDS",
+    "REFRESH_SESSION_KEY",
+    "entitled_courses",
+    "has_entitlement",
+    "has_entitlements",
+    "invalidate",
+    "invalidate_all",
+]
@@ -0,0 +1,385 @@
+# services/health.py
+"""
+健康檢查與優雅關機（zero-downtime deploy）。
+
+- /livez  ：行程活著且能回應（不碰外部依賴）；含進行中請求數。
+- /readyz ：可否接流量。啟動完成、未在 drain、關鍵依賴（DB）正常才回 200。
+            /health 與 /readyz 相同（負載平衡器沿用舊路徑即可）。
+- 依賴檢查（Probe）有快取（HEALTH_CACHE_SECONDS）且同一時間只跑一個，
+  探測請求再多也不會把 DB 打爆；卡住的檢查以 HEALTH_PROBE_TIMEOUT_SECONDS 判定失敗。
+    db       關鍵：主庫 SELECT 1
+    outbox   非關鍵：待處理訊息延遲超過 HEALTH_OUTBOX_MAX_LAG_SECONDS 視為 degraded
+    stripe   非關鍵：circuit breaker 狀態（open → degraded；Webhook 不依賴 Stripe API）
+    replica  非關鍵：唯讀 Engine 狀態（不可用時會自動回主庫）
+- SIGTERM → drain：
+    1) readiness 立刻回 503，仍照常服務 DRAIN_GRACE_SECONDS（等負載平衡器把本機移出）
+    2) 之後新請求回 503 + Retry-After（Stripe 會重送 webhook）
+    3) 等進行中請求完成（最多 DRAIN_TIMEOUT_SECONDS）後交回原本的 SIGTERM 處理（gunicorn 等）
+  outbox worker（flask outbox dispatch）收到 SIGTERM 會處理完手上這批才結束。
+"""
+
+from __future__ import annotations
+
+import _thread
+import logging
+import signal
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from flask import Flask, jsonify
+from werkzeug.wsgi import ClosingIterator
+
+log = logging.getLogger(__name__)
+
+HEALTH_PATHS = ("/livez", "/readyz", "/health")
+
+
+# -----------------------------
+# 依賴檢查（快取 + single-flight）
+# -----------------------------
+class Probe:
+    """
+    check() 回傳 dict（可含 ok=False 表示失敗），或丟例外表示失敗。
+    結果快取 ttl 秒；快取過期時只有一個呼叫者會真的執行檢查，其他人拿舊結果。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        check: Callable[[], Optional[Dict[str, Any]]],
+        critical: bool = True,
+        ttl: float = 2.0,
+        timeout: float = 2.0,
+    ) -> None:
+        self.name = name
+        self.check = check
+        self.critical = critical
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._last: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+
+    def result(self) -> Dict[str, Any]:
+        last = self._last
+        if last is not None and time.monotonic() - self._checked_at < self.ttl:
+            return last
+        if not self._lock.acquire(blocking=False):
+            # 另一個請求正在檢查（或上一次檢查還卡著）
+            return last or {"ok": False, "error": "check in progress"}
+        worker = threading.Thread(target=self._run, name=f"probe-{self.name}", daemon=True)
+        worker.start()
+        worker.join(self.timeout)
+        if worker.is_alive():
+            # 卡住的檢查仍持有鎖，完成前後續請求都拿這個結果
+            self._store({"ok": False, "error": f"timeout after {self.timeout}s"})
+        return self._last or {"ok": False, "error": "no result"}
+
+    def _run(self) -> None:
+        started = time.perf_counter()
+        try:
+            try:
+                out = dict(self.check() or {})
+                out.setdefault("ok", True)
+            except Exception as e:
+                out = {"ok": False, "error": f"{type(e).__name__}: {e}"[:300]}
+            out["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            self._store(out)
+        finally:
+            self._lock.release()
+
+    def _store(self, out: Dict[str, Any]) -> None:
+        self._last = out
+        self._checked_at = time.monotonic()
+
+
+def _check_db() -> Dict[str, Any]:
+    from sqlalchemy import text
+    from services.db import get_engine
+
+    engine = get_engine()
+    if engine is None:
+        return {"ok": False, "error": "DB not initialized"}
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return {}
+
+
+def _check_outbox(max_lag: float) -> Callable[[], Dict[str, Any]]:
+    def check() -> Dict[str, Any]:
+        from services.outbox import queue_stats
+
+        stats = queue_stats()
+        return {
+            "ok": stats["lag_seconds"] <= max_lag,
+            "pending": stats["pending"],
+            "dead": stats["dead"],
+            "lag_seconds": stats["lag_seconds"],
+        }
+
+    return check
+
+
+def _check_circuit(name: str) -> Callable[[], Dict[str, Any]]:
+    def check() -> Dict[str, Any]:
+        from services import circuit
+
+        b = circuit.get(name)
+        if b is None:
+            return {"state": "unused"}
+        out = b.as_dict()
+        out["ok"] = out["state"] != circuit.OPEN
+        return out
+
+    return check
+
+
+def _check_replica() -> Dict[str, Any]:
+    from services.db import replica_status
+
+    status = replica_status()
+    if not status["configured"]:
+        return {"configured": False}
+    lag = status["lag_seconds"]
+    status["ok"] = status["healthy"] and (lag is None or lag <= status["max_lag_seconds"])
+    return status
+
+
+# -----------------------------
+# 進行中請求與 drain 狀態
+# -----------------------------
+class DrainController:
+    """追蹤進行中請求數，並負責 SIGTERM 後的 drain 流程。"""
+
+    def __init__(self) -> None:
+        self.grace_seconds = 5.0
+        self.timeout_seconds = 25.0
+        self._cond = threading.Condition()
+        self._in_flight: Counter = Counter()
+        self._total = 0
+        self._started_at = time.monotonic()
+        self.ready = False
+        self.draining = False
+        self.accepting = True
+        self.drain_started_at: Optional[float] = None
+        self.rejected = 0
+        self._on_done: Optional[Callable[[], None]] = None
+
+    # ---- 進行中請求 ----
+    def enter(self, key: str) -> None:
+        with self._cond:
+            self._in_flight[key] += 1
+            self._total += 1
+
+    def leave(self, key: str) -> None:
+        with self._cond:
+            self._in_flight[key] -= 1
+            if self._in_flight[key] <= 0:
+                del self._in_flight[key]
+            self._total -= 1
+            if self._total <= 0:
+                self._cond.notify_all()
+
+    def in_flight(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"total": self._total, "by_prefix": dict(self._in_flight)}
+
+    def wait_idle(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._total > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # ---- drain ----
+    def begin_drain(self, reason: str = "SIGTERM") -> None:
+        """不阻塞：標記 drain 並在背景執行緒等待進行中請求完成。"""
+        with self._cond:
+            if self.draining:
+                return
+            self.draining = True
+            self.drain_started_at = time.monotonic()
+        # 可能在 signal handler 內：log 交給背景執行緒（避免主執行緒正持有 logging 鎖）
+        threading.Thread(target=self._drain, args=(reason,), name="drain", daemon=True).start()
+
+    def _drain(self, reason: str) -> None:
+        log.warning(
+            "[health] draining (%s): grace=%ss timeout=%ss in_flight=%s",
+            reason, self.grace_seconds, self.timeout_seconds, self.in_flight()["total"],
+        )
+        time.sleep(self.grace_seconds)
+        self.accepting = False
+        idle = self.wait_idle(self.timeout_seconds)
+        log.warning(
+            "[health] drain finished: idle=%s in_flight=%s rejected=%s",
+            idle, self.in_flight()["total"], self.rejected,
+        )
+        if self._on_done is not None:
+            self._on_done()
+
+    def as_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "uptime_seconds": round(time.monotonic() - self._started_at, 1),
+            "draining": self.draining,
+            "accepting": self.accepting,
+            "in_flight": self.in_flight(),
+        }
+        if self.drain_started_at is not None:
+            out["draining_for_seconds"] = round(time.monotonic() - self.drain_started_at, 1)
+            out["rejected"] = self.rejected
+        return out
+
+
+controller = DrainController()
+_probes: Dict[str, Probe] = {}
+
+
+class DrainMiddleware:
+    """WSGI 層計數（含串流回應直到 close）；drain 後拒絕新請求，健康檢查路徑不受影響。"""
+
+    def __init__(self, wsgi_app, ctrl: DrainController, exempt: Iterable[str] = HEALTH_PATHS) -> None:
+        self.wsgi_app = wsgi_app
+        self.ctrl = ctrl
+        self.exempt = frozenset(exempt)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "") or "/"
+        if path in self.exempt:
+            return self.wsgi_app(environ, start_response)
+        if not self.ctrl.accepting:
+            self.ctrl.rejected += 1
+            start_response("503 Service Unavailable", [
+                ("Content-Type", "application/json"),
+                ("Retry-After", "5"),
+                ("Connection", "close"),
+            ])
+            return [b'{"ok":false,"error":"server is draining"}']
+
+        key = "/" + path.lstrip("/").split("/", 1)[0]
+        self.ctrl.enter(key)
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self.ctrl.leave(key)
+            raise
+        return ClosingIterator(app_iter, [lambda: self.ctrl.leave(key)])
+
+
+# -----------------------------
+# 對外 API
+# -----------------------------
+def readiness() -> tuple[Dict[str, Any], int]:
+    checks = {name: p.result() for name, p in _probes.items()}
+    failing = [name for name, r in checks.items() if not r.get("ok")]
+    critical = [name for name in failing if _probes[name].critical]
+
+    if not controller.ready:
+        status = "starting"
+    elif controller.draining:
+        status = "draining"
+    elif critical:
+        status = "unavailable"
+    elif failing:
+        status = "degraded"
+    else:
+        status = "ok"
+    body = {"status": status, "checks": checks, **controller.as_dict()}
+    return body, 200 if status in ("ok", "degraded") else 503
+
+
+def mark_ready() -> None:
+    """create_app() 完成（DB、模板暖機等）後呼叫。"""
+    controller.ready = True
+
+
+def _install_sigterm(ctrl: DrainController) -> None:
+    """
+    SIGTERM 只標記 drain（handler 不能阻塞：sync worker 的請求也跑在主執行緒）。
+    drain 結束後交回原本的 handler（gunicorn 的 handle_exit 等）；原本是預設行為時中斷主執行緒。
+    """
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+    except ValueError:
+        return
+    # create_app() 被呼叫多次時，不要把自己的 handler 當成「原本的」handler
+    previous = getattr(previous, "_drain_previous", previous)
+
+    def on_done() -> None:
+        if callable(previous):
+            previous(signal.SIGTERM, None)
+        else:
+            _thread.interrupt_main()
+
+    def handler(signum, frame):
+        ctrl.begin_drain("SIGTERM")
+
+    handler._drain_previous = previous  # type: ignore[attr-defined]
+
+    try:
+        signal.signal(signal.SIGTERM, handler)
+    except ValueError:
+        # 不在主執行緒（例：被其他 WSGI 容器在子執行緒載入）：不接管
+        log.info("[health] not in main thread; SIGTERM drain disabled")
+        return
+    ctrl._on_done = on_done
+
+
+def init_health(app: Flask) -> None:
+    """註冊 /livez、/readyz、/health 與依賴檢查；包上計數 / drain middleware。"""
+    from services import circuit
+
+    cfg = app.config
+    ttl = float(cfg.get("HEALTH_CACHE_SECONDS", 2.0))
+    timeout = float(cfg.get("HEALTH_PROBE_TIMEOUT_SECONDS", 2.0))
+    _probes.clear()
+    _probes["db"] = Probe("db", _check_db, critical=True, ttl=ttl, timeout=timeout)
+    _probes["outbox"] = Probe(
+        "outbox",
+        _check_outbox(float(cfg.get("HEALTH_OUTBOX_MAX_LAG_SECONDS", 300))),
+        critical=False, ttl=max(ttl, 5.0), timeout=timeout,
+    )
+    _probes["stripe"] = Probe("stripe", _check_circuit("stripe"), critical=False, ttl=ttl, timeout=timeout)
+    _probes["replica"] = Probe("replica", _check_replica, critical=False, ttl=ttl, timeout=timeout)
+
+    circuit.breaker(
+        "stripe",
+        failure_threshold=int(cfg.get("STRIPE_CIRCUIT_FAILURES", 5)),
+        reset_timeout=float(cfg.get("STRIPE_CIRCUIT_RESET_SECONDS", 30)),
+    )
+
+    controller.grace_seconds = float(cfg.get("DRAIN_GRACE_SECONDS", 5))
+    controller.timeout_seconds = float(cfg.get("DRAIN_TIMEOUT_SECONDS", 25))
+    app.wsgi_app = DrainMiddleware(app.wsgi_app, controller)  # type: ignore[method-assign]
+    if cfg.get("DRAIN_ON_SIGTERM", True):
+        _install_sigterm(controller)
+
+    @app.get("/livez")
+    def livez():
+        return jsonify({"status": "alive", **controller.as_dict()})
+
+    @app.get("/readyz")
+    def readyz():
+        body, code = readiness()
+        resp = jsonify(body)
+        resp.status_code = code
+        resp.headers["Cache-Control"] = "no-store"
+        return resp
+
+    # 舊路徑：負載平衡器多半已設定 /health，語意改為 readiness
+    app.add_url_rule("/health", endpoint="health", view_func=readyz)
+
+
+__all__ = [
+    "DrainController",
+    "DrainMiddleware",
+    "Probe",
+    "controller",
+    "init_health",
+    "mark_ready",
+    "readiness",
+]
@@ -0,0 +1,121 @@
+# services/jsoncodec.py
+"""
+可替換的 JSON 編解碼：有安裝 orjson 就用 orjson，否則退回標準庫 json。
+
+用在三個熱點：
+- Flask 的 JSON provider（jsonify / request.get_json / 模板 tojson）
+- SQLAlchemy engine 的 json_serializer / json_deserializer（JSON 欄位）
+- Webhook：驗簽後只解析一次；原始 bytes 以 Raw() 包裝直接寫進 JSON 欄位，
+  不再 loads → dumps 來回轉換。
+
+    from services import jsoncodec
+    jsoncodec.dumps(obj) -> str
+    jsoncodec.loads(b"...") -> obj
+    jsoncodec.BACKEND        # "orjson" 或 "json"
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date
+from typing import Any, Callable
+
+from flask.json.provider import DefaultJSONProvider
+
+try:  # 選用套件：pip install orjson
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+class Raw:
+    """已序列化好的 JSON 文字；dumps() 遇到時原樣輸出（不會重新編碼）。"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, data: bytes | bytearray | memoryview | str) -> None:
+        self.text = data if isinstance(data, str) else bytes(data).decode("utf-8")
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<Raw {len(self.text)} chars>"
+
+
+def _default(o: Any) -> Any:
+    """標準庫與 orjson 都不認得的型別（規則與 Flask 預設一致）。"""
+    if isinstance(o, date):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    # datetime 交給 default 處理，與標準庫路徑的輸出一致
+    _OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps_bytes(obj: Any, default: Callable[[Any], Any] = _default, sort_keys: bool = False) -> bytes:
+        if type(obj) is Raw:
+            return obj.text.encode("utf-8")
+        opts = _OPTS | orjson.OPT_SORT_KEYS if sort_keys else _OPTS
+        return orjson.dumps(obj, default=default, option=opts)
+
+    def dumps(obj: Any, default: Callable[[Any], Any] = _default, sort_keys: bool = False) -> str:
+        if type(obj) is Raw:
+            return obj.text
+        return dumps_bytes(obj, default, sort_keys).decode("utf-8")
+
+    def loads(data: bytes | bytearray | memoryview | str) -> Any:
+        return orjson.loads(data)
+
+else:
+    def dumps(obj: Any, default: Callable[[Any], Any] = _default, sort_keys: bool = False) -> str:
+        if type(obj) is Raw:
+            return obj.text
+        return json.dumps(
+            obj, default=default, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")
+        )
+
+    def dumps_bytes(obj: Any, default: Callable[[Any], Any] = _default, sort_keys: bool = False) -> bytes:
+        return dumps(obj, default, sort_keys).encode("utf-8")
+
+    def loads(data: bytes | bytearray | memoryview | str) -> Any:
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider：一般情況走 jsoncodec（沿用 Flask 的 default 與 sort_keys 設定）；
+    呼叫端指定 indent / cls 等參數時（例如 tojson(indent=2)、debug 模式的縮排輸出），
+    退回 Flask 預設行為。
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, default=self.default, sort_keys=self.sort_keys)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = dumps_bytes(obj, default=self.default, sort_keys=self.sort_keys) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+__all__ = ["BACKEND", "FastJSONProvider", "Raw", "dumps", "dumps_bytes", "loads"]
@@ -0,0 +1,45 @@
+# services/mailer.py
+"""
+寄信介面（可替換）。專案目前沒有郵件服務，預設的 LoggingMailer 只寫 log；
+接上 SMTP / SES 等時，實作 send() 並在 create_app() 內呼叫 set_mailer() 即可。
+
+    class SmtpMailer:
+        def send(self, to: str, subject: str, body: str) -> None: ...
+
+    mailer.set_mailer(SmtpMailer(...))
+
+測試時以 set_mailer() 換成記錄寄件內容的假物件。
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Protocol
+
+log = logging.getLogger(__name__)
+
+
+class Mailer(Protocol):
+    def send(self, to: str, subject: str, body: str) -> None: ...
+
+
+class LoggingMailer:
+    """預設：不寄信，只記錄（開發環境 / 尚未設定郵件服務）。"""
+
+    def send(self, to: str, subject: str, body: str) -> None:
+        log.info("[mailer] (not sent) to=%s subject=%s", to, subject)
+
+
+_mailer: Mailer = LoggingMailer()
+
+
+def set_mailer(mailer: Mailer) -> None:
+    global _mailer
+    _mailer = mailer
+
+
+def get_mailer() -> Mailer:
+    return _mailer
+
+
+__all__ = ["LoggingMailer", "Mailer", "get_mailer", "set_mailer"]
@@ -4,7 +4,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional, Dict, Any
 
-from sqlalchemy import Integer, String, DateTime, JSON
+from sqlalchemy import Integer, String, DateTime, JSON, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -63,8 +63,14 @@ class Payment(Base):
     付款歸檔表，對應一次成功的 checkout.session.completed。
     - 以 stripe_session_id 去重，避免重送事件新增多筆。
     - amount_twd 以「元」保存（Webhook 傳回的 amount_total/100）。
+    - user_id 來自 checkout metadata；(user_id, course_id) 複合索引供權限查詢。
+    - updated_at 於新增/更新時自動設定（舊資料為 NULL，以 created_at 代替）。
+    - 依 created_at 按月分區；跨分區查詢請用 services.partitions（payments_source / locate）。
     """
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ix_payments_user_course", "user_id", "course_id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     stripe_session_id: Mapped[str] = mapped_column(String(128), unique=True, index=True)
@@ -72,10 +78,52 @@ class Payment(Base):
     amount_twd: Mapped[int] = mapped_column(Integer)  # 金額（元）
     status: Mapped[str] = mapped_column(String(32), default="unknown")  # e.g. "paid"
     buyer_email: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    user_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id"), nullable=True)
+    # 退款事件（charge.refunded）以 payment_intent 對回付款
+    stripe_payment_intent_id: Mapped[Optional[str]] = mapped_column(String(128), nullable=True, index=True)
+    # 分區鍵（services/partitions.py 依月份分區）；後台日期篩選也靠這個索引
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    # 每次寫入都會更新；API 以 max(id) / max(updated_at) 當作 ETag 的高水位
+    updated_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     def __repr__(self) -> str:  # pragma: no cover
         return (
             f"<Payment id={self.id} session={self.stripe_session_id!r} "
             f"course={self.course_id!r} amount_twd={self.amount_twd} status={self.status!r}>"
         )
+
+
+# -------------------------
+# Outbox（付款後的副作用：升級方案、寄收據、開通課程…）
+# -------------------------
+class OutboxMessage(Base):
+    """
+    與 Payment 在同一個交易寫入的待辦訊息，由 services.outbox.Dispatcher 非同步處理。
+    - status: pending / done / dead（重試次數用盡）
+    - lease_owner / lease_expires_at：worker 認領的租約，逾期可被其他 worker 接手。
+    - available_at：下次可處理時間（重試時以指數退避往後延）。
+    """
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        Index("ix_outbox_status_available", "status", "available_at"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    topic: Mapped[str] = mapped_column(String(64))
+    payload: Mapped[Dict[str, Any]] = mapped_column(JSON)
+    status: Mapped[str] = mapped_column(String(16), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    available_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return (
+            f"<OutboxMessage id={self.id} topic={self.topic!r} "
+            f"status={self.status!r} attempts={self.attempts}>"
+        )
@@ -0,0 +1,290 @@
+# services/outbox.py
+"""
+Transactional outbox：付款後的副作用不在 webhook() 內同步執行。
+
+- enqueue(s, topic, payload)：與 Payment 使用同一個 Session，隨同一次 commit 落地。
+- register(topic)：註冊處理函式 handler(payload) -> None；同一 topic 可有多個。
+  訊息失敗重試時會重跑該 topic 的所有 handler，因此 handler 需可重入（冪等）。
+- Dispatcher：批次認領（租約）→ 執行 handler → 成功標 done，失敗以指數退避重排，
+  超過 max_attempts 標 dead；stats() 提供吞吐量與延遲（lag）。
+
+測試時可傳入自己的 registry（dict），以本地假物件取代真正的 handler。
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_, select, update
+
+from services.db import get_read_session, get_session
+from services.models import OutboxMessage
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], None]
+
+# topic -> handlers（依註冊順序執行）
+_registry: Dict[str, List[Handler]] = {}
+
+TOPIC_PAYMENT_COMPLETED = "payment.completed"
+
+
+def register(topic: str, registry: Optional[Dict[str, List[Handler]]] = None):
+    """裝飾器：@register("payment.completed")"""
+    target = _registry if registry is None else registry
+
+    def deco(fn: Handler) -> Handler:
+        target.setdefault(topic, []).append(fn)
+        return fn
+
+    return deco
+
+
+def get_registry() -> Dict[str, List[Handler]]:
+    return _registry
+
+
+def enqueue(s, topic: str, payload: Dict[str, Any]) -> OutboxMessage:
+    """加入一筆 outbox 訊息；呼叫端負責 commit（與業務資料同一交易）。"""
+    msg = OutboxMessage(topic=topic, payload=payload, status="pending", attempts=0)
+    s.add(msg)
+    return msg
+
+
+class Dispatcher:
+    """
+    批次處理 outbox 訊息的 worker。可多個行程同時執行，靠租約避免重複處理。
+
+        d = Dispatcher(batch_size=100)
+        d.run_forever()          # 或 d.run_once()
+    """
+
+    def __init__(
+        self,
+        registry: Optional[Dict[str, List[Handler]]] = None,
+        batch_size: int = 50,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 8,
+        backoff_base: float = 2.0,
+        backoff_max: float = 3600.0,
+        worker_id: Optional[str] = None,
+    ) -> None:
+        self.registry = _registry if registry is None else registry
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self._stop = threading.Event()
+        self._started = time.monotonic()
+        self.processed = 0
+        self.failed = 0
+        self.dead = 0
+        self.batches = 0
+
+    # ---- 認領 ----
+    def claim_batch(self) -> List[OutboxMessage]:
+        """
+        以單一 UPDATE 取得租約：只有 pending、已到可處理時間、且租約為空或逾期的列會被認領。
+        多個 worker 同時執行時，同一列只會有一個 UPDATE 成功寫入自己的 lease_owner。
+        """
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        claimable = and_(
+            OutboxMessage.status == "pending",
+            OutboxMessage.available_at <= now,
+            or_(OutboxMessage.lease_expires_at.is_(None), OutboxMessage.lease_expires_at < now),
+        )
+        with get_session() as s:
+            ids = s.scalars(
+                select(OutboxMessage.id)
+                .where(claimable)
+                .order_by(OutboxMessage.available_at, OutboxMessage.id)
+                .limit(self.batch_size)
+            ).all()
+            if not ids:
+                return []
+            s.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_(ids))
+                .where(claimable)
+                .values(lease_owner=self.worker_id, lease_expires_at=lease_until)
+            )
+            s.commit()
+            rows = s.scalars(
+                select(OutboxMessage)
+                .where(OutboxMessage.id.in_(ids))
+                .where(OutboxMessage.lease_owner == self.worker_id)
+                .where(OutboxMessage.lease_expires_at == lease_until)
+                .order_by(OutboxMessage.id)
+            ).all()
+            s.expunge_all()
+        return list(rows)
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.backoff_base ** attempts, self.backoff_max)
+
+    # ---- 執行 ----
+    def _handle(self, msg: OutboxMessage) -> Optional[str]:
+        """執行該 topic 的所有 handler；成功回 None，失敗回錯誤訊息。"""
+        handlers = self.registry.get(msg.topic) or []
+        if not handlers:
+            log.warning("[outbox] no handler for topic=%s id=%s", msg.topic, msg.id)
+        try:
+            for fn in handlers:
+                fn(msg.payload or {})
+        except Exception as e:
+            log.exception("[outbox] handler failed: topic=%s id=%s", msg.topic, msg.id)
+            return f"{type(e).__name__}: {e}"[:500]
+        return None
+
+    def run_once(self) -> int:
+        """處理一批；回傳本批認領筆數（0 表示目前沒有工作）。"""
+        batch = self.claim_batch()
+        if not batch:
+            return 0
+        self.batches += 1
+
+        results = [(msg, self._handle(msg)) for msg in batch]
+
+        now = datetime.utcnow()
+        with get_session() as s:
+            for msg, error in results:
+                attempts = (msg.attempts or 0) + 1
+                values: Dict[str, Any] = {
+                    "attempts": attempts,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                }
+                if error is None:
+                    values.update(status="done", processed_at=now, last_error=None)
+                    self.processed += 1
+                elif attempts >= self.max_attempts:
+                    values.update(status="dead", processed_at=now, last_error=error)
+                    self.failed += 1
+                    self.dead += 1
+                else:
+                    delay = self._backoff(attempts)
+                    values.update(available_at=now + timedelta(seconds=delay), last_error=error)
+                    self.failed += 1
+                # 只更新自己仍持有租約的列（租約逾期被接手時不覆寫別人的結果）
+                s.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id == msg.id)
+                    .where(OutboxMessage.lease_owner == self.worker_id)
+                    .values(**values)
+                )
+            s.commit()
+        return len(batch)
+
+    def run_forever(self, idle_sleep: float = 1.0) -> None:
+        """持續處理直到 stop()；佇列空時休息 idle_sleep 秒，滿批時立即處理下一批。"""
+        while not self._stop.is_set():
+            try:
+                n = self.run_once()
+            except Exception:
+                log.exception("[outbox] dispatch loop error")
+                n = 0
+            if n < self.batch_size:
+                self._stop.wait(idle_sleep)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # ---- 觀測 ----
+    def stats(self) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        out: Dict[str, Any] = {
+            "worker_id": self.worker_id,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dead": self.dead,
+            "batches": self.batches,
+            "throughput_per_sec": round(self.processed / elapsed, 3),
+        }
+        out.update(queue_stats())
+        return out
+
+
+def queue_stats() -> Dict[str, Any]:
+    """整體佇列狀態：各狀態筆數與最舊待處理訊息的延遲秒數。"""
+    now = datetime.utcnow()
+    with get_read_session() as s:
+        counts = dict(
+            s.execute(
+                select(OutboxMessage.status, func.count()).group_by(OutboxMessage.status)
+            ).all()
+        )
+        oldest = s.scalar(
+            select(func.min(OutboxMessage.created_at)).where(OutboxMessage.status == "pending")
+        )
+    return {
+        "pending": counts.get("pending", 0),
+        "done": counts.get("done", 0),
+        "dead": counts.get("dead", 0),
+        "lag_seconds": round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
+
+
+# -----------------------------
+# 內建 handler：payment.completed
+# -----------------------------
+@register(TOPIC_PAYMENT_COMPLETED)
+def upgrade_user_plan(payload: Dict[str, Any]) -> None:
+    """付款完成：把 free 方案的使用者升級為 paid（已是其他方案則不動）。"""
+    from services.models import User
+
+    user_id = payload.get("user_id")
+    if not user_id or payload.get("status") != "paid":
+        return
+    with get_session() as s:
+        user = s.get(User, int(user_id))
+        if user and user.plan == "free":
+            user.plan = "paid"
+            s.commit()
+
+
+# 課程開通不需要 handler：權限直接以 payments 為準，webhook 寫入後已在 web 行程內
+# 讓該使用者的 entitlement 快取失效（dispatcher 行程的快取沒有人讀，清了也沒用）。
+
+
+@register(TOPIC_PAYMENT_COMPLETED)
+def send_receipt(payload: Dict[str, Any]) -> None:
+    """
+    寄送收據（services.mailer，可替換；預設只寫 log）。
+    放在最後註冊：前面的 handler 失敗重試時不會先寄出一封。
+    """
+    from services.mailer import get_mailer
+
+    email = payload.get("email")
+    if not email or payload.get("status") != "paid":
+        return
+    get_mailer().send(
+        email,
+        f"付款收據：{payload.get('course_id')}",
+        (
+            f"感謝購買課程 {payload.get('course_id')}。\n"
+            f"金額：NT$ {payload.get('amount_twd')}\n"
+            f"訂單編號：{payload.get('session_id')}\n"
+        ),
+    )
+
+
+__all__ = [
+    "TOPIC_PAYMENT_COMPLETED",
+    "Dispatcher",
+    "enqueue",
+    "get_registry",
+    "queue_stats",
+    "register",
+]
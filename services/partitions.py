@@ -0,0 +1,437 @@
+# services/partitions.py
+"""
+payments 依月份（created_at）分區，後台清單 / API 只查與日期範圍重疊的分區。
+
+- PostgreSQL：原生 RANGE 分區。payments 為分區父表，子表 payments_YYYYMM，
+  另有 payments_default 接住尚未建立分區的月份；查詢帶 created_at 條件時由 planner 剪枝。
+  分區父表的 UNIQUE 必須含分區鍵，stripe_session_id 改為 UNIQUE (stripe_session_id, created_at)；
+  created_at 取自 Stripe session 的 created，同一 session 重送 / 對帳寫入的值相同，仍可去重。
+- SQLite：payments 為「熱表」，所有寫入都在這裡；rotate() 把已結束且超出 hot_months 的月份
+  搬到 payments_YYYYMM，並重建 payments_all（UNION ALL view，供人工 / 報表 SQL 使用）。
+  程式內讀取以 payments_source() 只 UNION 與日期範圍重疊的月份表。
+- locate()：依欄位找單筆付款；在 SQLite 封存表找到時搬回熱表，之後可直接用 ORM 更新
+  （例：舊訂單退款），下次 rotate() 再搬回去。
+- insert_payments()：INSERT … ON CONFLICT DO NOTHING；webhook 與對帳同時寫入同一 session 時只會有一筆。
+- detach()：把某月分區匯出成 cold storage 檔案（JSON Lines + gzip）後移除。
+
+    flask partitions rotate            # 建議每日排程
+    flask partitions list
+    flask partitions detach --month 2024-01
+"""
+
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import (
+    Column, Index, MetaData, Table, delete, func, insert, inspect, literal, select, text, union_all,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import aliased
+
+from services.db import get_engine
+from services.models import Payment
+
+log = logging.getLogger(__name__)
+
+HOT_TABLE = "payments"
+VIEW_NAME = "payments_all"
+DEFAULT_PARTITION = "payments_default"
+_NAME_RE = re.compile(r"^payments_(\d{4})(\d{2})$")
+
+# 封存表的 Table 物件（欄位與 payments 相同，不掛在 Base.metadata 上，create_all 不會碰）
+_archive_md = MetaData()
+_archive_lock = threading.Lock()
+
+
+# -----------------------------
+# 月份工具
+# -----------------------------
+def month_start(d: date | datetime) -> datetime:
+    return datetime(d.year, d.month, 1)
+
+
+def add_months(m: datetime, n: int) -> datetime:
+    idx = m.year * 12 + (m.month - 1) + n
+    return datetime(idx // 12, idx % 12 + 1, 1)
+
+
+def partition_name(month: date | datetime) -> str:
+    return f"{HOT_TABLE}_{month.year:04d}{month.month:02d}"
+
+
+def _month_of(name: str) -> Optional[datetime]:
+    m = _NAME_RE.match(name)
+    if not m:
+        return None
+    year, mon = int(m.group(1)), int(m.group(2))
+    return datetime(year, mon, 1) if 1 <= mon <= 12 else None
+
+
+def _overlaps(month: datetime, lo: Optional[datetime], hi: Optional[datetime]) -> bool:
+    """月份 [month, 下月) 與查詢範圍 [lo, hi) 是否重疊（None 表示不設限）。"""
+    return (hi is None or month < hi) and (lo is None or add_months(month, 1) > lo)
+
+
+def _lit(d: datetime) -> str:
+    """DDL 無法使用 bind 參數；日期由本模組計算，直接內嵌為字面值。"""
+    return f"'{d:%Y-%m-%d %H:%M:%S}'"
+
+
+# -----------------------------
+# 分區清單
+# -----------------------------
+def list_partitions(bind: Connection | Engine) -> List[Tuple[datetime, str]]:
+    """目前存在的月份分區（依月份排序）；不含熱表與 payments_default。"""
+    out = []
+    for name in inspect(bind).get_table_names():
+        month = _month_of(name)
+        if month is not None:
+            out.append((month, name))
+    return sorted(out)
+
+
+def _archive_table(name: str) -> Table:
+    """取得（或建立）與 payments 同欄位的 Table 物件；索引名稱加上分區名避免衝突。"""
+    with _archive_lock:
+        t = _archive_md.tables.get(name)
+        if t is not None:
+            return t
+        src = Payment.__table__
+        t = Table(
+            name,
+            _archive_md,
+            *[
+                Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+                for c in src.columns
+            ],
+        )
+        for idx in src.indexes:
+            Index(
+                idx.name.replace(f"ix_{HOT_TABLE}_", f"ix_{name}_", 1),
+                *[t.c[c.name] for c in idx.columns],
+                unique=idx.unique,
+            )
+        return t
+
+
+def _is_postgres(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+# -----------------------------
+# 讀取：分區剪枝
+# -----------------------------
+def payments_source(s, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None):
+    """
+    回傳查詢 payments 用的 ORM 實體，用法與 Payment 相同（P.created_at、select(P)…）：
+    - PostgreSQL / 沒有封存表 → Payment 本身（PostgreSQL 由 planner 依 WHERE 剪枝）
+    - SQLite → 熱表 + 與 [date_from, date_to) 重疊的月份表 UNION ALL 後的別名
+    呼叫端仍需自行加上 created_at 條件；這裡只決定要掃哪些表。
+    """
+    conn = s.connection()
+    if _is_postgres(conn):
+        return Payment
+    names = [name for month, name in list_partitions(conn) if _overlaps(month, date_from, date_to)]
+    if not names:
+        return Payment
+    selects = [select(*Payment.__table__.columns)]
+    selects += [select(*_archive_table(name).columns) for name in names]
+    return aliased(Payment, union_all(*selects).subquery("payments_p"), name="payments_p")
+
+
+def layout_key(s) -> str:
+    """目前分區配置（用於 ETag：rotate 不改結果，detach 會）。"""
+    return ",".join(name for _, name in list_partitions(s.connection()))
+
+
+def locate(s, **eq: Any) -> Optional[Payment]:
+    """
+    依欄位相等條件找一筆付款（例：locate(s, stripe_session_id=sid)）。
+    SQLite 熱表找不到時查封存表；找到就搬回熱表並回傳 ORM 物件（呼叫端 commit）。
+    """
+    pay = s.scalars(select(Payment).filter_by(**eq).limit(1)).first()
+    conn = s.connection()
+    if pay is not None or _is_postgres(conn):
+        return pay
+
+    parts = list_partitions(conn)
+    if not parts:
+        return None
+    probes = []
+    for _, name in reversed(parts):  # 新的月份優先
+        t = _archive_table(name)
+        probes.append(
+            select(literal(name).label("src"), t.c.id).where(*[t.c[k] == v for k, v in eq.items()])
+        )
+    hit = s.execute(union_all(*probes).limit(1)).first()
+    if hit is None:
+        return None
+
+    src, pid = hit
+    t = _archive_table(src)
+    row = dict(s.execute(select(t).where(t.c.id == pid)).mappings().one())
+    s.execute(delete(t).where(t.c.id == pid))
+    s.execute(insert(Payment.__table__).values(**row))
+    log.info("[partitions] promoted payment id=%s from %s back to %s", pid, src, HOT_TABLE)
+    return s.get(Payment, pid)
+
+
+def insert_payments(s, rows: List[Dict[str, Any]]) -> List[str]:
+    """
+    批次新增付款；stripe_session_id 已存在者略過（INSERT … ON CONFLICT DO NOTHING）。
+    回傳實際寫入的 stripe_session_id，呼叫端只為這些寫 outbox，避免並行寫入造成重複副作用。
+    """
+    if not rows:
+        return []
+    if _is_postgres(s.connection()):
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    hot = Payment.__table__
+    stmt = dialect_insert(hot).on_conflict_do_nothing().returning(hot.c.stripe_session_id)
+    return list(s.execute(stmt, rows).scalars())
+
+
+# -----------------------------
+# 輪替
+# -----------------------------
+def rotate(
+    now: Optional[datetime] = None,
+    hot_months: int = 3,
+    premake: int = 2,
+    engine: Optional[Engine] = None,
+) -> Dict[str, Any]:
+    """
+    PostgreSQL：必要時把 payments 轉成分區表，並預先建立到 now + premake 個月的分區。
+    SQLite：把早於「本月往前 hot_months - 1 個月」的資料逐月搬到封存表（每月一個交易）。
+    """
+    engine = engine or get_engine()
+    assert engine is not None, "DB not initialized; call init_db() first."
+    now = now or datetime.utcnow()
+    if _is_postgres(engine):
+        return _rotate_postgres(engine, now, premake)
+    return _rotate_sqlite(engine, now, max(hot_months, 1))
+
+
+def _rotate_sqlite(engine: Engine, now: datetime, hot_months: int) -> Dict[str, Any]:
+    hot = Payment.__table__
+    cutoff = add_months(month_start(now), -(hot_months - 1))
+    moved: Dict[str, int] = {}
+
+    with engine.connect() as conn:
+        oldest = conn.scalar(select(func.min(hot.c.created_at)).where(hot.c.created_at < cutoff))
+    month = month_start(oldest) if oldest else cutoff
+
+    while month < cutoff:
+        nxt = add_months(month, 1)
+        with engine.begin() as conn:
+            # 熱表保留 id 最大的那筆：SQLite 以 max(rowid)+1 配號，熱表清空會重複使用封存表的 id
+            keep_id = conn.scalar(select(func.max(hot.c.id)))
+            where = [hot.c.created_at >= month, hot.c.created_at < nxt, hot.c.id != keep_id]
+            n = conn.scalar(select(func.count()).select_from(hot).where(*where)) or 0
+            if n:
+                t = _archive_table(partition_name(month))
+                t.create(conn, checkfirst=True)
+                conn.execute(insert(t).from_select([c.name for c in hot.columns], select(*hot.columns).where(*where)))
+                conn.execute(delete(hot).where(*where))
+                moved[t.name] = n
+        month = nxt
+
+    with engine.begin() as conn:
+        _refresh_view(conn)
+        parts = [name for _, name in list_partitions(conn)]
+    if moved:
+        log.info("[partitions] rotated %s", moved)
+    return {"moved": moved, "hot_since": cutoff.date().isoformat(), "partitions": parts}
+
+
+def _refresh_view(conn: Connection) -> None:
+    """重建 payments_all = 熱表 UNION ALL 所有封存表（SQLite）。"""
+    cols = ", ".join(c.name for c in Payment.__table__.columns)
+    parts = [f"SELECT {cols} FROM {HOT_TABLE}"]
+    parts += [f"SELECT {cols} FROM {name}" for _, name in list_partitions(conn)]
+    conn.execute(text(f"DROP VIEW IF EXISTS {VIEW_NAME}"))
+    conn.execute(text(f"CREATE VIEW {VIEW_NAME} AS " + " UNION ALL ".join(parts)))
+
+
+def _pg_is_partitioned(conn: Connection) -> bool:
+    return bool(conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"
+    ), {"t": HOT_TABLE}))
+
+
+def _pg_convert(conn: Connection, now: datetime, premake: int) -> None:
+    """一次性把既有的 payments 轉成 RANGE 分區表（同一交易，失敗整體回滾）。"""
+    log.warning("[partitions] converting %s to a partitioned table", HOT_TABLE)
+    conn.execute(text(f"ALTER TABLE {HOT_TABLE} RENAME TO {HOT_TABLE}_legacy"))
+    conn.execute(text(f"ALTER SEQUENCE IF EXISTS {HOT_TABLE}_id_seq OWNED BY NONE"))
+    conn.execute(text(
+        f"CREATE TABLE {HOT_TABLE} (LIKE {HOT_TABLE}_legacy INCLUDING DEFAULTS) "
+        f"PARTITION BY RANGE (created_at)"
+    ))
+    conn.execute(text(f"ALTER TABLE {HOT_TABLE} ADD PRIMARY KEY (id, created_at)"))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {HOT_TABLE} DEFAULT"))
+
+    oldest = conn.scalar(text(f"SELECT min(created_at) FROM {HOT_TABLE}_legacy"))
+    month = month_start(oldest or now)
+    while month <= add_months(month_start(now), premake):
+        _pg_add_partition(conn, month)
+        month = add_months(month, 1)
+
+    conn.execute(text(f"INSERT INTO {HOT_TABLE} SELECT * FROM {HOT_TABLE}_legacy"))
+    conn.execute(text(f"DROP TABLE {HOT_TABLE}_legacy"))
+    conn.execute(text(f"ALTER SEQUENCE IF EXISTS {HOT_TABLE}_id_seq OWNED BY {HOT_TABLE}.id"))
+    # 索引沿用模型上的名稱（create_all 的 checkfirst 才認得）；
+    # 分區表的 UNIQUE 必須包含分區鍵，補上 created_at（stripe_session_id → (stripe_session_id, created_at)）
+    for idx in Payment.__table__.indexes:
+        cols = [c.name for c in idx.columns]
+        if idx.unique and "created_at" not in cols:
+            cols.append("created_at")
+        unique = "UNIQUE " if idx.unique else ""
+        conn.execute(text(f"CREATE {unique}INDEX {idx.name} ON {HOT_TABLE} ({', '.join(cols)})"))
+    conn.execute(text(f"ALTER TABLE {HOT_TABLE} ADD FOREIGN KEY (user_id) REFERENCES users (id)"))
+
+
+def _pg_add_partition(conn: Connection, month: datetime) -> bool:
+    """建立月份分區；payments_default 內已有該月資料時先搬過去再 ATTACH。"""
+    name = partition_name(month)
+    if conn.scalar(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": name}):
+        return False
+    lo, hi = _lit(month), _lit(add_months(month, 1))
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {HOT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    if conn.scalar(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": DEFAULT_PARTITION}):
+        rng = f"created_at >= {lo} AND created_at < {hi}"
+        conn.execute(text(f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {rng}"))
+        conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {rng}"))
+    conn.execute(text(f"ALTER TABLE {HOT_TABLE} ATTACH PARTITION {name} FOR VALUES FROM ({lo}) TO ({hi})"))
+    return True
+
+
+def _rotate_postgres(engine: Engine, now: datetime, premake: int) -> Dict[str, Any]:
+    created = []
+    with engine.begin() as conn:
+        if not _pg_is_partitioned(conn):
+            _pg_convert(conn, now, premake)
+        month = month_start(now)
+        for _ in range(premake + 1):
+            if _pg_add_partition(conn, month):
+                created.append(partition_name(month))
+            month = add_months(month, 1)
+        parts = [name for _, name in list_partitions(conn)]
+    return {"created": created, "partitions": parts}
+
+
+# -----------------------------
+# 封存（cold storage）
+# -----------------------------
+def detach(
+    month: date | datetime,
+    cold_dir: str | Path,
+    allow_entitled: bool = False,
+    engine: Optional[Engine] = None,
+) -> Path:
+    """
+    把某月分區寫成 cold_dir/payments_YYYYMM.jsonl.gz 後移除（檔案寫完才 DROP，同一交易）。
+    課程權限以 payments 為準，分區內有已付款資料時需 allow_entitled=True 才會移除。
+    """
+    from services import jsoncodec
+    from services.entitlements import ENTITLED_STATUSES, invalidate_all
+
+    engine = engine or get_engine()
+    assert engine is not None, "DB not initialized; call init_db() first."
+    name = partition_name(month_start(month))
+    cold_dir = Path(cold_dir)
+    cold_dir.mkdir(parents=True, exist_ok=True)
+    target = cold_dir / f"{name}.jsonl.gz"
+    tmp = target.with_name(target.name + ".tmp")
+
+    with engine.begin() as conn:
+        if name not in {n for _, n in list_partitions(conn)}:
+            raise ValueError(f"partition not found: {name}")
+        t = _archive_table(name)
+        entitled = conn.scalar(
+            select(func.count()).select_from(t).where(t.c.status.in_(ENTITLED_STATUSES))
+        ) or 0
+        if entitled and not allow_entitled:
+            raise ValueError(f"{name} has {entitled} entitled payments; pass allow_entitled=True to detach")
+
+        if _is_postgres(conn):
+            conn.execute(text(f"ALTER TABLE {HOT_TABLE} DETACH PARTITION {name}"))
+
+        n = 0
+        try:
+            # fsync 要用寫入的 handle（Windows 上對唯讀 handle fsync 會失敗）
+            with open(tmp, "wb") as raw:
+                with gzip.GzipFile(filename=target.stem, mode="wb", fileobj=raw) as fh:
+                    for row in conn.execute(select(t).order_by(t.c.id)).mappings():
+                        fh.write(jsoncodec.dumps_bytes(dict(row)) + b"\n")
+                        n += 1
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(tmp, target)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+        conn.execute(text(f"DROP TABLE {name}"))
+        if not _is_postgres(conn):
+            _refresh_view(conn)
+
+    with _archive_lock:
+        if name in _archive_md.tables:
+            _archive_md.remove(_archive_md.tables[name])
+    if entitled:
+        invalidate_all()
+    log.info("[partitions] detached %s (%s rows) -> %s", name, n, target)
+    return target
+
+
+# -----------------------------
+# 啟動時同步
+# -----------------------------
+def init_partitions(engine: Optional[Engine] = None) -> None:
+    """
+    SQLite：payments 新增欄位後，封存表也補上同名欄位（可為 NULL 者），並重建 view；
+    否則 UNION ALL 的欄位數會對不上。PostgreSQL 分區會跟著父表變更，不需處理。
+    """
+    engine = engine or get_engine()
+    if engine is None or _is_postgres(engine):
+        return
+    parts = list_partitions(engine)
+    if not parts:
+        return
+    insp = inspect(engine)
+    changed = VIEW_NAME not in insp.get_view_names()
+    with engine.begin() as conn:
+        for _, name in parts:
+            have = {c["name"] for c in insp.get_columns(name)}
+            for col in Payment.__table__.columns:
+                if col.name not in have and col.nullable:
+                    coltype = col.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {col.name} {coltype}"))
+                    changed = True
+        if changed:
+            _refresh_view(conn)
+
+
+__all__ = [
+    "add_months",
+    "detach",
+    "init_partitions",
+    "insert_payments",
+    "layout_key",
+    "list_partitions",
+    "locate",
+    "month_start",
+    "partition_name",
+    "payments_source",
+    "rotate",
+]
@@ -0,0 +1,281 @@
+# services/profiling.py
+"""
+每個請求的延遲統計與按需取樣 profiler。
+
+- 延遲直方圖：依 endpoint 累計，時間拆成 db / stripe / template / python（其餘）。
+  db 來自 SQLAlchemy cursor 事件、template 來自 Flask 的 template 訊號、
+  stripe 由呼叫端以 span("stripe") 包住外部呼叫。
+- 取樣 profiler：請求帶 X-Profile: <PROFILE_TOKEN>，或依 PROFILE_SAMPLE_RATE 隨機觸發；
+  以背景執行緒定期擷取該請求執行緒的堆疊，結束時寫出 collapsed-stack 檔
+  （每行 "a;b;c 次數"，可直接給 flamegraph.pl / speedscope）。
+  未觸發時每個請求只多一次標頭比對與（rate > 0 時）一次亂數。
+
+    init_profiling(app)        # create_app() 內呼叫一次
+    with span("stripe"): ...   # 包住 Stripe 呼叫
+    snapshot()                 # 取得所有 endpoint 的統計
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextvars
+import hmac
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import Flask, g, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 直方圖桶上界（毫秒），最後一桶為 +Inf
+BUCKETS_MS: List[float] = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+COMPONENTS = ("db", "stripe", "template", "python")
+
+# 目前請求的分段計時器（請求外為 None，事件處理直接略過）
+_current: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "coursepay_profile_timers", default=None
+)
+
+
+class Histogram:
+    """固定桶的延遲直方圖；percentile() 以桶上界估計。"""
+
+    __slots__ = ("counts", "count", "total_ms", "max_ms")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, pct: float) -> float:
+        """估計值：落點桶的上界（不超過實際最大值）。"""
+        if not self.count:
+            return 0.0
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                bound = BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {
+                (f"le_{b:g}" if i < len(BUCKETS_MS) else "inf"): n
+                for i, (b, n) in enumerate(zip(BUCKETS_MS + [float("inf")], self.counts))
+            },
+        }
+
+
+class _RouteStats:
+    __slots__ = ("total", "parts")
+
+    def __init__(self) -> None:
+        self.total = Histogram()
+        self.parts = {name: Histogram() for name in COMPONENTS}
+
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, _RouteStats] = {}
+
+
+def _record(endpoint: str, total_ms: float, parts: Dict[str, float]) -> None:
+    with _stats_lock:
+        rs = _stats.get(endpoint)
+        if rs is None:
+            rs = _stats[endpoint] = _RouteStats()
+        rs.total.observe(total_ms)
+        for name in COMPONENTS:
+            rs.parts[name].observe(parts.get(name, 0.0))
+
+
+def snapshot() -> Dict[str, Any]:
+    """所有 endpoint 的延遲統計（總時間與各分段）。"""
+    with _stats_lock:
+        return {
+            ep: {
+                "total": rs.total.as_dict(),
+                **{name: rs.parts[name].as_dict() for name in COMPONENTS},
+            }
+            for ep, rs in sorted(_stats.items())
+        }
+
+
+def reset() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """把區塊耗時累加到目前請求的分段（例：with span("stripe"): ...）。"""
+    timers = _current.get()
+    if timers is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timers[name] = timers.get(name, 0.0) + (time.perf_counter() - t0) * 1000
+
+
+# -----------------------------
+# 取樣 profiler
+# -----------------------------
+class StackSampler:
+    """以固定間隔擷取指定執行緒的堆疊，累計成 collapsed stacks。"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="coursepay-profiler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: Path) -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            for stack, n in self.samples.most_common():
+                f.write(f"{stack} {n}\n")
+        return path
+
+
+def _want_profile(app: Flask) -> bool:
+    token = app.config.get("PROFILE_TOKEN") or ""
+    header = request.headers.get("X-Profile")
+    if token and header and hmac.compare_digest(header, token):
+        return True
+    rate = app.config.get("PROFILE_SAMPLE_RATE") or 0.0
+    return rate > 0 and random.random() < rate
+
+
+# -----------------------------
+# 掛載到 Flask / SQLAlchemy
+# -----------------------------
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    # 開始時間放在該次執行的 context 上：語句失敗時 after_cursor_execute 不會觸發，
+    # context 隨之丟棄，不會像放在 conn.info 那樣在連線池的連線上越積越多
+    if context is not None and _current.get() is not None:
+        context._coursepay_t0 = time.perf_counter()
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    timers = _current.get()
+    start = getattr(context, "_coursepay_t0", None)
+    if timers is not None and start is not None:
+        timers["db"] = timers.get("db", 0.0) + (time.perf_counter() - start) * 1000
+
+
+def _before_render(sender, template, context, **extra):
+    if _current.get() is not None:
+        g._profile_tpl_start = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    timers = _current.get()
+    start = g.pop("_profile_tpl_start", None)
+    if timers is not None and start is not None:
+        timers["template"] = timers.get("template", 0.0) + (time.perf_counter() - start) * 1000
+
+
+def init_profiling(app: Flask) -> None:
+    """註冊請求前後掛勾、SQLAlchemy 事件與 template 訊號。"""
+    if not app.config.get("LATENCY_HISTOGRAMS", True):
+        return
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor):
+        event.listen(Engine, "before_cursor_execute", _before_cursor)
+        event.listen(Engine, "after_cursor_execute", _after_cursor)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    profile_dir = Path(app.config.get("PROFILE_DIR") or Path(app.instance_path) / "profiles")
+    interval = float(app.config.get("PROFILE_INTERVAL_MS") or 5) / 1000.0
+
+    @app.before_request
+    def _profile_start():
+        g._profile_token = _current.set({})
+        g._profile_t0 = time.perf_counter()
+        if _want_profile(app):
+            g._profile_sampler = StackSampler(threading.get_ident(), interval).start()
+
+    @app.teardown_request
+    def _profile_finish(exc):
+        t0 = g.pop("_profile_t0", None)
+        token = g.pop("_profile_token", None)
+        if t0 is None or token is None:
+            return
+        timers = _current.get() or {}
+        _current.reset(token)
+
+        total_ms = (time.perf_counter() - t0) * 1000
+        other = sum(timers.get(name, 0.0) for name in ("db", "stripe", "template"))
+        timers["python"] = max(total_ms - other, 0.0)
+        endpoint = request.endpoint or "<unmatched>"
+        _record(endpoint, total_ms, timers)
+
+        sampler = g.pop("_profile_sampler", None)
+        if sampler is not None:
+            sampler.stop()
+            name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{endpoint.replace('.', '_')}.collapsed"
+            try:
+                path = sampler.write_collapsed(profile_dir / name)
+                app.logger.info(f"[profile] {request.path} {total_ms:.1f}ms -> {path}")
+            except OSError as e:
+                app.logger.warning(f"[profile] write failed: {e}")
+
+
+__all__ = [
+    "BUCKETS_MS",
+    "COMPONENTS",
+    "Histogram",
+    "StackSampler",
+    "init_profiling",
+    "reset",
+    "snapshot",
+    "span",
+]
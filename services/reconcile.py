@@ -0,0 +1,291 @@
+# services/reconcile.py
+"""
+對帳：找出 Stripe 有、但 payments 缺少（或狀態落後）的 Checkout Session 並補寫。
+
+流程：
+1) 將 [date_from, date_to) 切成多個時間窗，以有限併發（ThreadPoolExecutor）
+   各自分頁抓取 checkout sessions（Stripe 的 cursor 分頁本身只能循序）。
+2) 主執行緒逐頁處理：以 hash join（stripe_session_id IN (...) → set）比對 payments，
+   批次 INSERT 缺少的付款、修正狀態，並寫入 outbox 讓後續副作用照常發生。
+3) 每頁處理完把該時間窗的 cursor 寫入 checkpoint 檔；中斷後以同一檔案重跑會接續。
+
+Stripe API 來源可由 Config.STRIPE_API_BASE 指到本地 stripe-mock；
+也可傳入 lister（假物件）取代真正的 Stripe 呼叫。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from services.db import get_session
+from services import outbox, partitions
+from services.webhooks import PRE_PAYMENT_STATUSES, payment_values_from_session
+
+log = logging.getLogger(__name__)
+
+# lister(created_gte, created_lt, starting_after, limit) -> (sessions, has_more)
+Lister = Callable[[int, int, Optional[str], int], Tuple[List[Dict[str, Any]], bool]]
+
+_IN_CHUNK = 500
+
+
+def stripe_lister(api_key: str, api_base: Optional[str] = None) -> Lister:
+    """以 stripe SDK 分頁列出 checkout sessions（api_base 可指向 stripe-mock）。"""
+    import stripe
+
+    if api_base:
+        stripe.api_base = api_base
+
+    def _list(gte: int, lt: int, starting_after: Optional[str], limit: int):
+        params: Dict[str, Any] = {"created": {"gte": gte, "lt": lt}, "limit": limit}
+        if starting_after:
+            params["starting_after"] = starting_after
+        page = stripe.checkout.Session.list(api_key=api_key, **params)
+        data = [obj.to_dict() if hasattr(obj, "to_dict") else dict(obj) for obj in page.data]
+        return data, bool(page.has_more)
+
+    return _list
+
+
+# -----------------------------
+# Checkpoint
+# -----------------------------
+class Checkpoint:
+    """時間窗 → {"cursor": 最後處理的 session id, "done": bool}；以原子寫入保存成 JSON。"""
+
+    def __init__(self, path: Optional[str | Path]) -> None:
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self.windows: Dict[str, Dict[str, Any]] = {}
+        if self.path and self.path.exists():
+            self.windows = json.loads(self.path.read_text(encoding="utf-8")).get("windows", {})
+
+    def get(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.windows.get(key) or {})
+
+    def update(self, key: str, cursor: Optional[str], done: bool) -> None:
+        with self._lock:
+            self.windows[key] = {"cursor": cursor, "done": done}
+            if not self.path:
+                return
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp.write_text(json.dumps({"windows": self.windows}, indent=2), encoding="utf-8")
+            os.replace(tmp, self.path)
+
+
+# -----------------------------
+# 比對與修補
+# -----------------------------
+@dataclass
+class ReconcileReport:
+    fetched: int = 0
+    missing: int = 0
+    status_fixed: int = 0
+    repaired: int = 0
+    windows: int = 0
+    missing_ids: List[str] = field(default_factory=list)
+    # 抓取失敗的時間窗（"gte-lt: 錯誤"）；非空代表本次對帳不完整，需以同一 checkpoint 重跑
+    failed_windows: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed_windows
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "fetched": self.fetched,
+            "missing": self.missing,
+            "status_fixed": self.status_fixed,
+            "repaired": self.repaired,
+            "windows": self.windows,
+            "missing_ids": self.missing_ids[:100],
+            "failed_windows": self.failed_windows,
+        }
+
+
+def _existing_status(s, session_ids: List[str]) -> Dict[str, str]:
+    """hash join 的 build 端：分塊 IN 查詢，只取 id 與 status 兩欄。"""
+    found: Dict[str, str] = {}
+    P = partitions.payments_source(s)  # 舊月份可能已輪替到封存分區
+    for i in range(0, len(session_ids), _IN_CHUNK):
+        chunk = session_ids[i:i + _IN_CHUNK]
+        rows = s.execute(
+            select(P.stripe_session_id, P.status)
+            .where(P.stripe_session_id.in_(chunk))
+        )
+        found.update((sid, status) for sid, status in rows)
+    return found
+
+
+def reconcile_page(
+    sessions: Iterable[Dict[str, Any]], report: ReconcileReport, dry_run: bool = False
+) -> None:
+    """比對一頁 sessions 並批次修補（同一交易內寫入 payments + outbox）。"""
+    # 只處理完成的結帳（對應 checkout.session.completed）
+    wanted = {
+        obj["id"]: payment_values_from_session(obj)
+        for obj in sessions
+        if obj.get("id") and obj.get("status") == "complete"
+    }
+    report.fetched += len(wanted)
+    if not wanted:
+        return
+
+    with get_session() as s:
+        existing = _existing_status(s, sorted(wanted))
+        to_insert = [v for sid, v in wanted.items() if sid not in existing]
+        # 只把付款前的紀錄推進到 paid；paid / 已退款不動（避免退款被改回 paid、重複寫 outbox）
+        to_fix = [
+            v for sid, v in wanted.items()
+            if sid in existing and v["status"] == "paid"
+            and (not existing[sid] or existing[sid] in PRE_PAYMENT_STATUSES)
+        ]
+        report.missing += len(to_insert)
+        report.status_fixed += len(to_fix)
+        report.missing_ids.extend(v["stripe_session_id"] for v in to_insert)
+        if dry_run or not (to_insert or to_fix):
+            return
+
+        # 並行的 webhook 可能剛寫入同一 session：ON CONFLICT 略過，outbox 只為實際寫入的那些
+        inserted = set(partitions.insert_payments(s, to_insert))
+        to_insert = [v for v in to_insert if v["stripe_session_id"] in inserted]
+        for v in to_fix:
+            pay = partitions.locate(s, stripe_session_id=v["stripe_session_id"])
+            pay.status = "paid"
+            if pay.user_id is None:
+                pay.user_id = v["user_id"]
+        for v in to_insert + to_fix:
+            if v["status"] == "paid":
+                outbox.enqueue(s, outbox.TOPIC_PAYMENT_COMPLETED, {
+                    "session_id": v["stripe_session_id"],
+                    "user_id": v["user_id"],
+                    "course_id": v["course_id"],
+                    "amount_twd": v["amount_twd"],
+                    "email": v["buyer_email"],
+                    "status": v["status"],
+                    "source": "reconcile",
+                })
+        s.commit()
+        report.repaired += len(to_insert) + len(to_fix)
+
+
+# -----------------------------
+# 主流程
+# -----------------------------
+def _windows(date_from: datetime, date_to: datetime, window: timedelta) -> List[Tuple[int, int]]:
+    out = []
+    cur = date_from
+    while cur < date_to:
+        nxt = min(cur + window, date_to)
+        out.append((int(cur.timestamp()), int(nxt.timestamp())))
+        cur = nxt
+    return out
+
+
+def reconcile(
+    date_from: datetime,
+    date_to: datetime,
+    lister: Lister,
+    concurrency: int = 4,
+    page_size: int = 100,
+    window: timedelta = timedelta(days=1),
+    checkpoint_path: Optional[str | Path] = None,
+    dry_run: bool = False,
+) -> ReconcileReport:
+    """
+    對帳 [date_from, date_to)（UTC）。concurrency 為同時抓取的時間窗數上限；
+    抓取在 worker 執行緒，DB 比對/寫入集中在呼叫端執行緒，避免 SQLite 寫入互搶。
+    """
+    if date_from.tzinfo is None:
+        date_from = date_from.replace(tzinfo=timezone.utc)
+    if date_to.tzinfo is None:
+        date_to = date_to.replace(tzinfo=timezone.utc)
+
+    ckpt = Checkpoint(checkpoint_path)
+    report = ReconcileReport()
+    pending = [
+        (gte, lt) for gte, lt in _windows(date_from, date_to, window)
+        if not ckpt.get(f"{gte}-{lt}").get("done")
+    ]
+    report.windows = len(pending)
+    if not pending:
+        return report
+
+    # 有界佇列：抓取速度快於寫入時會自然背壓
+    pages: "queue.Queue[Tuple[str, Any, Optional[str], bool]]" = queue.Queue(maxsize=concurrency * 2)
+    stop = threading.Event()
+    _DONE = object()
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch_window(gte: int, lt: int) -> None:
+        key = f"{gte}-{lt}"
+        cursor = ckpt.get(key).get("cursor")
+        try:
+            while not stop.is_set():
+                data, has_more = lister(gte, lt, cursor, page_size)
+                cursor = data[-1]["id"] if data else cursor
+                last = not has_more or not data
+                if not _put((key, data, cursor, last)) or last:
+                    break
+        except Exception as e:
+            log.exception("[reconcile] fetch window %s failed", key)
+            _put((key, e, cursor, False))
+        finally:
+            _put((key, _DONE, None, False))
+
+    errors = report.failed_windows
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        for gte, lt in pending:
+            pool.submit(fetch_window, gte, lt)
+
+        try:
+            remaining = len(pending)
+            while remaining:
+                key, data, cursor, last = pages.get()
+                if data is _DONE:
+                    remaining -= 1
+                    continue
+                if isinstance(data, Exception):
+                    errors.append(f"{key}: {data}")
+                    continue
+                reconcile_page(data, report, dry_run=dry_run)
+                if not dry_run:
+                    ckpt.update(key, cursor, done=last)
+        finally:
+            # 比對/寫入出錯時讓抓取執行緒盡快結束，避免卡在 put()
+            stop.set()
+
+    if errors:
+        log.warning("[reconcile] %d window(s) failed; rerun with the same checkpoint: %s",
+                    len(errors), errors)
+    return report
+
+
+__all__ = [
+    "Checkpoint",
+    "ReconcileReport",
+    "payment_values_from_session",
+    "reconcile",
+    "reconcile_page",
+    "stripe_lister",
+]
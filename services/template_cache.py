@@ -0,0 +1,69 @@
+# services/template_cache.py
+"""
+Jinja 模板預先編譯與 bytecode 快取。
+
+- init_template_cache(app)：設定磁碟上的 FileSystemBytecodeCache（多個 worker 共用同一目錄，
+  編譯結果只需產生一次；Jinja 以暫存檔 + rename 寫入，不會讀到半個檔案）。
+- precompile_templates(app)：編譯所有 .html 模板（含 courses_fallback.html 這類只在
+  失敗路徑用到的模板），寫入 bytecode 快取並留在 Environment 的記憶體快取中。
+- create_app() 依 TEMPLATE_WARMUP 在啟動時呼叫；部署時也可先跑 `flask templates compile`。
+"""
+
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Dict
+
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+
+TEMPLATE_SUFFIXES = (".html", ".jinja", ".j2")
+
+
+def init_template_cache(app: Flask) -> None:
+    cache_dir = app.config.get("TEMPLATE_CACHE_DIR") or str(Path(app.instance_path) / "jinja_cache")
+    if cache_dir.lower() in ("0", "off", "none"):
+        return
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+
+def precompile_templates(app: Flask, rebuild: bool = False) -> Dict[str, float]:
+    """
+    編譯所有模板；回傳 {模板名稱: 毫秒}（另含 "__total__"）。
+    rebuild=True 時先清掉記憶體與磁碟快取，強制從原始碼重新編譯。
+    """
+    env = app.jinja_env
+    if rebuild:
+        if env.cache is not None:
+            env.cache.clear()
+        if env.bytecode_cache is not None:
+            env.bytecode_cache.clear()
+    timings: Dict[str, float] = {}
+    t_all = time.perf_counter()
+    for name in sorted(env.list_templates()):
+        if not name.endswith(TEMPLATE_SUFFIXES):
+            continue
+        t0 = time.perf_counter()
+        try:
+            env.get_template(name)
+        except Exception as e:  # 單一模板語法錯誤不影響其他模板的暖機
+            app.logger.warning(f"[templates] compile {name} failed: {e}")
+            continue
+        timings[name] = round((time.perf_counter() - t0) * 1000, 3)
+    timings["__total__"] = round((time.perf_counter() - t_all) * 1000, 3)
+    return timings
+
+
+def warm_up(app: Flask) -> Dict[str, float]:
+    """啟動時預先編譯並記錄耗時（結果也存於 app.extensions 供除錯路由查看）。"""
+    timings = precompile_templates(app)
+    app.extensions["coursepay_template_warmup"] = timings
+    app.logger.info(
+        f"[templates] warmed {len(timings) - 1} templates in {timings['__total__']}ms"
+    )
+    return timings
+
+
+__all__ = ["init_template_cache", "precompile_templates", "warm_up"]
@@ -0,0 +1,254 @@
+# services/webhooks.py
+"""
+Stripe webhook 事件路由：依事件類型分派到處理函式，並提早丟棄不關心的事件。
+
+- handles(type)：註冊 handler(s, obj, event) -> None；s 為 DB Session（呼叫端 commit）。
+- peek_event_types(raw)：不解析 JSON，只以 regex 從原始 bytes 找出「可能的」事件類型。
+  事件類型一定含 "."（例 charge.succeeded），巢狀物件的 "type"（例 card）通常不含，
+  因此候選集合必定包含真正的類型；只要候選都不是已註冊類型，就能在解析前安全丟棄。
+- 未處理類型的政策（WEBHOOK_IGNORED_POLICY）：
+    store   照舊寫入 webhook_events（預設）
+    sample  依 WEBHOOK_IGNORED_SAMPLE_RATE 抽樣寫入，其餘丟棄
+    drop    直接回 200，不解析、不碰資料庫
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import re
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Set
+
+from sqlalchemy import select
+
+from services import entitlements, outbox, partitions
+from services.models import Payment, WebhookEvent
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[[Any, Dict[str, Any], Dict[str, Any]], None]
+
+_handlers: Dict[str, Handler] = {}
+
+IGNORED_POLICIES = ("store", "sample", "drop")
+
+# 曾付款成功（含之後退款）的狀態：為終態，重送 / 較舊的事件與對帳都不會改動，也不再觸發 outbox
+PAID_STATUSES = ("paid", "partially_refunded", "refunded")
+# 付款前的狀態：可被較新的事件或對帳推進到 paid
+PRE_PAYMENT_STATUSES = ("unpaid", "expired", "failed", "unknown")
+
+_TYPE_RE = re.compile(rb'"type"\s*:\s*"([a-z0-9_]+(?:\.[a-z0-9_]+)+)"')
+
+
+def handles(*event_types: str):
+    """裝飾器：@handles("checkout.session.completed")"""
+
+    def deco(fn: Handler) -> Handler:
+        for et in event_types:
+            _handlers[et] = fn
+        return fn
+
+    return deco
+
+
+def get_handler(event_type: str) -> Optional[Handler]:
+    return _handlers.get(event_type)
+
+
+def handled_types() -> Set[str]:
+    return set(_handlers)
+
+
+def peek_event_types(raw: bytes) -> Set[str]:
+    """從原始 payload 找出所有形如 a.b 的 "type" 值（不解析 JSON）。"""
+    return {m.decode("ascii") for m in _TYPE_RE.findall(raw)}
+
+
+def should_drop_early(raw: bytes, policy: str, sample_rate: float = 0.0) -> bool:
+    """
+    解析前判斷：候選類型都不是已註冊類型時，依政策決定是否丟棄。
+    候選集合為空（格式異常）時不丟，交給後續正常流程回報錯誤。
+    """
+    if policy == "store":
+        return False
+    candidates = peek_event_types(raw)
+    if not candidates or candidates & _handlers.keys():
+        return False
+    if policy == "sample":
+        return random.random() >= sample_rate
+    return policy == "drop"
+
+
+# -----------------------------
+# 共用：Checkout Session → payments 欄位
+# -----------------------------
+def _id_of(value: Any) -> Optional[str]:
+    """Stripe 欄位可能是 id 字串，也可能是 expand 後的物件。"""
+    if isinstance(value, dict):
+        return value.get("id")
+    return value or None
+
+
+def _created_at(obj: Dict[str, Any]) -> datetime:
+    """Stripe 的 created（epoch 秒，UTC）→ naive UTC datetime（與 created_at 欄位一致）。"""
+    created = obj.get("created")
+    if isinstance(created, (int, float)) and created > 0:
+        return datetime.fromtimestamp(created, tz=timezone.utc).replace(tzinfo=None)
+    return datetime.utcnow()
+
+
+def payment_values_from_session(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把 Checkout Session 轉成 payments 欄位（webhook 與對帳共用）。
+    created_at 取 session 建立時間，對帳補寫的舊付款才會落在正確的日期 / 月份分區。
+    """
+    meta = obj.get("metadata") or {}
+    status = obj.get("payment_status")
+    try:
+        user_id = int(meta.get("user_id")) if meta.get("user_id") else None
+    except (TypeError, ValueError):
+        user_id = None
+    return {
+        "stripe_session_id": obj.get("id") or "",
+        "course_id": meta.get("course_id") or "unknown",
+        "amount_twd": int((obj.get("amount_total") or 0) / 100),  # 分 → 元
+        "status": "paid" if status == "paid" else (status or "unknown"),
+        "buyer_email": (obj.get("customer_details") or {}).get("email"),
+        "user_id": user_id,
+        "stripe_payment_intent_id": _id_of(obj.get("payment_intent")),
+        "created_at": _created_at(obj),
+    }
+
+
+def enqueue_payment_completed(s, pay: Payment, **extra: Any) -> None:
+    """付款成立後的副作用（升級方案、收據、開通課程）寫入 outbox，與 payment 同一交易。"""
+    outbox.enqueue(s, outbox.TOPIC_PAYMENT_COMPLETED, {
+        "session_id": pay.stripe_session_id,
+        "user_id": pay.user_id,
+        "course_id": pay.course_id,
+        "amount_twd": pay.amount_twd,
+        "email": pay.buyer_email,
+        "status": pay.status,
+        **extra,
+    })
+
+
+def _upsert_from_session(s, obj: Dict[str, Any], force_status: Optional[str] = None) -> Payment:
+    values = payment_values_from_session(obj)
+    if force_status:
+        values["status"] = force_status
+    sid = values["stripe_session_id"]
+    pay = partitions.locate(s, stripe_session_id=sid)
+    if not pay:
+        # 先查再寫之間可能有並行的重送 / 對帳寫入同一 session：衝突時略過，改走下方的更新
+        created = bool(partitions.insert_payments(s, [values]))
+        pay = partitions.locate(s, stripe_session_id=sid)
+        if created:
+            if pay.status == "paid":
+                enqueue_payment_completed(s, pay)
+            return pay
+
+    # Stripe 可能重送事件：僅更新狀態與缺漏的關聯欄位，不新增
+    # 已付款 / 已退款的紀錄為終態，不會被重送或較舊的事件改回 paid 或未付款
+    was_paid = pay.status in PAID_STATUSES
+    if not was_paid:
+        pay.status = values["status"] or pay.status
+    if pay.user_id is None:
+        pay.user_id = values["user_id"]
+    if pay.stripe_payment_intent_id is None:
+        pay.stripe_payment_intent_id = values["stripe_payment_intent_id"]
+    if pay.status == "paid" and not was_paid:
+        enqueue_payment_completed(s, pay)
+    return pay
+
+
+def _locate_by_payment_intent(s, pi: str) -> Optional[Payment]:
+    """
+    依 payment_intent 找付款。stripe_payment_intent_id 欄位加入前寫入的付款為 NULL：
+    改從保存的 checkout.session.* 事件（webhook_events）找回 session，補上欄位後回傳。
+    """
+    pay = partitions.locate(s, stripe_payment_intent_id=pi)
+    if pay is not None:
+        return pay
+    obj_path = ("data", "object")
+    sid = s.scalar(
+        select(WebhookEvent.payload[obj_path + ("id",)].as_string())
+        .where(WebhookEvent.type.like("checkout.session.%"))
+        .where(WebhookEvent.payload[obj_path + ("payment_intent",)].as_string() == pi)
+        .limit(1)
+    )
+    if not sid:
+        return None
+    pay = partitions.locate(s, stripe_session_id=sid)
+    if pay is not None and pay.stripe_payment_intent_id is None:
+        pay.stripe_payment_intent_id = pi
+        log.info("[webhook] backfilled payment_intent=%s for session=%s", pi, sid)
+    return pay
+
+
+# -----------------------------
+# Handlers
+# -----------------------------
+@handles("checkout.session.completed")
+def on_session_completed(s, obj: Dict[str, Any], event: Dict[str, Any]) -> None:
+    pay = _upsert_from_session(s, obj)
+    s.commit()
+    entitlements.invalidate(pay.user_id)
+    log.info(
+        "[webhook] checkout.completed stored: session=%s course_id=%s amount_twd=%s status=%s",
+        pay.stripe_session_id, pay.course_id, pay.amount_twd, pay.status,
+    )
+
+
+@handles("checkout.session.async_payment_succeeded")
+def on_async_payment_succeeded(s, obj: Dict[str, Any], event: Dict[str, Any]) -> None:
+    pay = _upsert_from_session(s, obj, force_status="paid")
+    s.commit()
+    entitlements.invalidate(pay.user_id)
+
+
+@handles("checkout.session.async_payment_failed")
+def on_async_payment_failed(s, obj: Dict[str, Any], event: Dict[str, Any]) -> None:
+    pay = _upsert_from_session(s, obj, force_status="failed")
+    s.commit()
+    entitlements.invalidate(pay.user_id)
+
+
+@handles("checkout.session.expired")
+def on_session_expired(s, obj: Dict[str, Any], event: Dict[str, Any]) -> None:
+    """過期的結帳只更新既有紀錄（未付款者）；不為從未付款的 session 新增資料。"""
+    pay = partitions.locate(s, stripe_session_id=obj.get("id") or "")
+    if pay and pay.status not in PAID_STATUSES:
+        pay.status = "expired"
+        s.commit()
+
+
+@handles("charge.refunded")
+def on_charge_refunded(s, obj: Dict[str, Any], event: Dict[str, Any]) -> None:
+    """全額退款 → refunded（收回課程權限）；部分退款 → partially_refunded。"""
+    pi = _id_of(obj.get("payment_intent"))
+    if not pi:
+        return
+    pay = _locate_by_payment_intent(s, pi)
+    if not pay:
+        log.warning("[webhook] charge.refunded for unknown payment_intent=%s", pi)
+        return
+    full = obj.get("refunded") or (obj.get("amount_refunded") or 0) >= (obj.get("amount") or 0)
+    pay.status = "refunded" if full else "partially_refunded"
+    s.commit()
+    entitlements.invalidate(pay.user_id)
+
+
+__all__ = [
+    "IGNORED_POLICIES",
+    "PAID_STATUSES",
+    "PRE_PAYMENT_STATUSES",
+    "enqueue_payment_completed",
+    "get_handler",
+    "handled_types",
+    "handles",
+    "payment_values_from_session",
+    "peek_event_types",
+    "should_drop_early",
+]
@@ -0,0 +1,61 @@
+# tests/conftest.py
+"""
+測試共用 fixture：每個測試一個全新的 SQLite 檔案（不需要 Flask app 與 Stripe）。
+
+    python -m pytest -q
+"""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from services import db as _db  # noqa: E402
+from services import entitlements  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """初始化臨時資料庫並建表；回傳 get_session。權限快取跨測試會殘留，前後都清掉。"""
+    entitlements.invalidate_all()
+    _db.init_db(f"sqlite:///{(tmp_path / 'test.db').as_posix()}")
+    _db.create_all()
+    yield _db.get_session
+    engine = _db.get_engine()
+    if engine is not None:
+        engine.dispose()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """以臨時 SQLite 建立 Flask app（不裝 SIGTERM handler、不寫 instance/ 快取）。"""
+    from config import Config
+
+    overrides = {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{(tmp_path / 'app.db').as_posix()}",
+        "SQLITE_WAL": False,
+        "READ_REPLICA_ENABLED": False,
+        "DRAIN_ON_SIGTERM": False,
+        "TEMPLATE_CACHE_DIR": "off",
+        "TEMPLATE_WARMUP": False,
+        "STRIPE_API_KEY": "",
+        "ADMIN_API_TOKEN": "test-admin-token",
+    }
+    for key, value in overrides.items():
+        monkeypatch.setattr(Config, key, value)
+    entitlements.invalidate_all()
+
+    import app as app_module  # 第一次 import 會以上面的設定執行模組層的 create_app()
+
+    flask_app = app_module.create_app()
+    flask_app.config["TESTING"] = True
+    yield flask_app
+    engine = _db.get_engine()
+    if engine is not None:
+        engine.dispose()
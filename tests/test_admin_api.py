@@ -0,0 +1,77 @@
+# tests/test_admin_api.py
+"""後台 JSON API：X-Admin-Token 驗證與 lookup 的輸入檢查。"""
+
+from __future__ import annotations
+
+from datetime import datetime
+
+import pytest
+
+from services.db import get_session
+from services.models import Payment
+
+TOKEN = {"X-Admin-Token": "test-admin-token"}
+
+
+@pytest.fixture
+def client(app):
+    with get_session() as s:
+        s.add(Payment(stripe_session_id="cs_0", course_id="c1", amount_twd=100, status="paid",
+                      buyer_email="a@example.com", created_at=datetime(2024, 5, 1)))
+        s.commit()
+    return app.test_client()
+
+
+@pytest.mark.parametrize("method, url", [
+    ("get", "/admin/api/payments"),
+    ("post", "/admin/api/payments/lookup"),
+])
+def test_api_requires_token(client, method, url):
+    resp = getattr(client, method)(url, json={"session_ids": ["cs_0"]})
+    assert resp.status_code == 401
+    resp = getattr(client, method)(url, json={"session_ids": ["cs_0"]}, headers={"X-Admin-Token": "nope"})
+    assert resp.status_code == 401
+
+
+def test_api_disabled_without_configured_token(app, client):
+    app.config["ADMIN_API_TOKEN"] = ""
+    assert client.get("/admin/api/payments", headers=TOKEN).status_code == 403
+    assert client.get("/admin/ping").status_code == 200  # 其他後台路由不受影響
+
+
+def test_lookup_with_token(client):
+    resp = client.post("/admin/api/payments/lookup", headers=TOKEN,
+                       json={"session_ids": ["cs_0", "cs_x"], "fields": ["status", "buyer_email"]})
+    assert resp.status_code == 200
+    assert resp.get_json() == {
+        "ok": True,
+        "items": [{"status": "paid", "buyer_email": "a@example.com"}],
+        "missing": ["cs_x"],
+    }
+    resp = client.post("/admin/api/payments/lookup", headers=TOKEN,
+                       json={"session_ids": ["cs_0"], "fields": "course_id, amount_twd"})
+    assert resp.get_json()["items"] == [{"course_id": "c1", "amount_twd": 100}]
+
+
+@pytest.mark.parametrize("body", [
+    [1],
+    "cs_0",
+    {"session_ids": "cs_0"},
+    {"session_ids": [1]},
+    {"session_ids": ["cs_0", None]},
+    {"session_ids": []},
+    {"session_ids": ["cs_0"], "fields": [1]},
+    {"session_ids": ["cs_0"], "fields": {"status": 1}},
+    {"session_ids": ["cs_0"], "fields": ["nope"]},
+])
+def test_lookup_rejects_bad_input(client, body):
+    resp = client.post("/admin/api/payments/lookup", headers=TOKEN, json=body)
+    assert resp.status_code == 400
+    assert resp.get_json()["ok"] is False
+
+
+def test_list_with_token_and_fields(client):
+    resp = client.get("/admin/api/payments?fields=stripe_session_id,status", headers=TOKEN)
+    assert resp.status_code == 200
+    assert resp.get_json()["items"] == [{"stripe_session_id": "cs_0", "status": "paid"}]
+    assert client.get("/admin/api/payments?fields=nope", headers=TOKEN).status_code == 400
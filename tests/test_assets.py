@@ -0,0 +1,54 @@
+# tests/test_assets.py
+"""靜態檔建置：重新 build 不刪除仍被舊 manifest 引用的檔案，超過 keep 代才清掉。"""
+
+from __future__ import annotations
+
+import json
+
+from flask import Flask
+
+from services.assets import build_assets, init_assets
+
+
+def _build(static, css, keep=3):
+    (static / "styles.css").write_text(css, encoding="utf-8")
+    return build_assets(static, keep=keep)["styles.css"]
+
+
+def test_rebuild_keeps_previous_generations(tmp_path):
+    static = tmp_path / "static"
+    static.mkdir()
+    (static / "js").mkdir()
+    (static / "js" / "app.js").write_text("console.log(1)", encoding="utf-8")
+    dist = static / "dist"
+
+    first = _build(static, "body{color:red}")
+    app = Flask(__name__, static_folder=str(static))
+    init_assets(app)  # 非 debug：manifest 只在啟動時讀一次（仍指向 first）
+    client = app.test_client()
+
+    second = _build(static, "body{color:blue}")
+    assert first != second
+    with app.test_request_context():
+        assert app.jinja_env.globals["asset_url"]("styles.css") == f"/assets/{first}"
+    resp = client.get(f"/assets/{first}", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200 and resp.headers["Content-Encoding"] == "gzip"
+    resp.close()
+    assert json.loads((dist / "manifest.json").read_text())["styles.css"] == second
+    assert client.get("/assets/manifest-history.json").status_code == 404
+
+    third = _build(static, "body{color:green}")
+    fourth = _build(static, "body{color:black}")
+    assert not (dist / first).exists() and not (dist / f"{first}.gz").exists()
+    for name in (second, third, fourth):
+        assert (dist / name).exists()
+    assert (dist / "js").is_dir()  # 內容沒變的檔案照常保留
+
+
+def test_rebuild_without_changes_is_a_noop(tmp_path):
+    static = tmp_path / "static"
+    static.mkdir()
+    hashed = _build(static, "a{}", keep=1)
+    before = sorted(p.name for p in (static / "dist").iterdir())
+    assert _build(static, "a{}", keep=1) == hashed
+    assert sorted(p.name for p in (static / "dist").iterdir()) == before
@@ -0,0 +1,81 @@
+# tests/test_entitlements.py
+"""已購課程索引：快取 / 批次查詢（含封存分區）與結帳完成後略過快取。"""
+
+from __future__ import annotations
+
+from datetime import datetime
+
+from services import entitlements, partitions
+from services.db import get_session
+from services.models import Payment, User
+
+
+def _seed(get_session, rows):
+    with get_session() as s:
+        for uid in {r[0] for r in rows}:
+            s.add(User(id=uid, email=f"u{uid}@example.com"))
+        for i, (uid, course_id, status, created_at) in enumerate(rows):
+            s.add(Payment(stripe_session_id=f"cs_{i}", course_id=course_id, amount_twd=100,
+                          status=status, user_id=uid, created_at=created_at))
+        s.commit()
+
+
+def test_has_entitlements_uses_cache_and_queries_archived_partitions(db):
+    _seed(db, [
+        (1, "c1", "paid", datetime(2024, 6, 1)),
+        (2, "c1", "paid", datetime(2024, 1, 10)),                # rotate 後在 payments_202401
+        (2, "c2", "partially_refunded", datetime(2024, 2, 10)),  # 部分退款仍有權限
+        (2, "c3", "refunded", datetime(2024, 6, 2)),
+        (3, "c9", "unpaid", datetime(2024, 6, 3)),               # id 最大：留在熱表
+    ])
+    partitions.rotate(now=datetime(2024, 6, 15), hot_months=3)
+
+    assert entitlements.entitled_courses(1) == frozenset({"c1"})  # user 1 進快取
+    with db() as s:  # 直接改 DB、不 invalidate：快取中的 user 1 仍以快取判斷
+        s.get(Payment, 1).status = "refunded"
+        s.commit()
+
+    pairs = [(1, "c1"), (1, "c2"), (2, "c1"), (2, "c2"), (2, "c3"), (3, "c9")]
+    assert entitlements.has_entitlements(pairs) == {(1, "c1"), (2, "c1"), (2, "c2")}
+
+    entitlements.invalidate(1)
+    assert entitlements.has_entitlements(pairs) == {(2, "c1"), (2, "c2")}
+    assert entitlements.has_entitlements([]) == set()
+
+
+def test_entitled_courses_fresh_skips_cache(db):
+    _seed(db, [(1, "c1", "paid", datetime(2024, 6, 1))])
+    assert entitlements.entitled_courses(1) == frozenset({"c1"})
+    with db() as s:
+        s.add(Payment(stripe_session_id="cs_new", course_id="c2", amount_twd=100,
+                      status="paid", user_id=1, created_at=datetime(2024, 6, 2)))
+        s.commit()
+
+    assert entitlements.entitled_courses(1) == frozenset({"c1"})  # 快取
+    assert entitlements.entitled_courses(1, fresh=True) == frozenset({"c1", "c2"})
+    assert entitlements.entitled_courses(1) == frozenset({"c1", "c2"})  # fresh 順便更新快取
+
+
+def test_courses_page_skips_stale_cache_after_checkout(app):
+    with get_session() as s:
+        s.add(User(id=1, email="u1@example.com"))
+        s.commit()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = "1"
+
+    assert "購買 Python 入門" in client.get("/courses").get_data(as_text=True)
+
+    # 付款由另一個 worker 的 webhook 寫入：本行程的快取不知道
+    with get_session() as s:
+        s.add(Payment(stripe_session_id="cs_1", course_id="course_py_basic", amount_twd=990,
+                      status="paid", user_id=1))
+        s.commit()
+    assert "購買 Python 入門" in client.get("/courses").get_data(as_text=True)
+
+    assert client.get("/billing/success?session_id=cs_1").status_code == 200
+    # 模擬 /courses 由另一個 worker 處理、該 worker 仍快取著空集合
+    entitlements._cache_put(1, frozenset())
+    page = client.get("/courses").get_data(as_text=True)
+    assert "已購買 Python 入門" in page
+    assert "購買 Python 入門" not in page.replace("已購買 Python 入門", "")
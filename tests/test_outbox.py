@@ -0,0 +1,172 @@
+# tests/test_outbox.py
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from services import mailer, outbox
+from services.models import OutboxMessage
+
+
+def _enqueue(get_session, n=1, topic="t"):
+    with get_session() as s:
+        for i in range(n):
+            outbox.enqueue(s, topic, {"i": i})
+        s.commit()
+
+
+def _messages(get_session):
+    with get_session() as s:
+        return s.query(OutboxMessage).order_by(OutboxMessage.id).all()
+
+
+def _make_available(get_session):
+    """把重排的訊息拉回「現在可處理」，不用真的等退避時間。"""
+    with get_session() as s:
+        for m in s.query(OutboxMessage).filter_by(status="pending"):
+            m.available_at = datetime.utcnow() - timedelta(seconds=1)
+        s.commit()
+
+
+def test_lease_prevents_double_claim(db):
+    _enqueue(db, 3)
+    a = outbox.Dispatcher(registry={}, worker_id="a")
+    b = outbox.Dispatcher(registry={}, worker_id="b")
+
+    assert len(a.claim_batch()) == 3
+    assert b.claim_batch() == []  # 租約期間別人拿不到
+
+    with db() as s:  # 租約逾期（worker a 當掉）→ 可被接手
+        for m in s.query(OutboxMessage):
+            m.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+        s.commit()
+    claimed = b.claim_batch()
+    assert len(claimed) == 3
+    assert {m.lease_owner for m in claimed} == {"b"}
+
+
+def test_success_marks_done_and_calls_handlers_in_order(db):
+    calls = []
+    registry = {}
+    outbox.register("t", registry)(lambda p: calls.append(("first", p["i"])))
+    outbox.register("t", registry)(lambda p: calls.append(("second", p["i"])))
+    _enqueue(db, 2)
+
+    d = outbox.Dispatcher(registry=registry)
+    assert d.run_once() == 2
+    assert calls == [("first", 0), ("second", 0), ("first", 1), ("second", 1)]
+    msgs = _messages(db)
+    assert [m.status for m in msgs] == ["done", "done"]
+    assert all(m.attempts == 1 and m.lease_owner is None for m in msgs)
+
+
+def test_failure_retries_with_backoff(db):
+    attempts = []
+    registry = {}
+
+    @outbox.register("t", registry)
+    def flaky(payload):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("boom")
+
+    _enqueue(db)
+    d = outbox.Dispatcher(registry=registry, backoff_base=10.0)
+    before = datetime.utcnow()
+    assert d.run_once() == 1
+
+    (msg,) = _messages(db)
+    assert msg.status == "pending"
+    assert msg.attempts == 1
+    assert "RuntimeError: boom" in msg.last_error
+    # 第 1 次失敗退避 backoff_base ** 1 = 10 秒
+    assert msg.available_at >= before + timedelta(seconds=9)
+    assert d.run_once() == 0  # 退避期間不會被認領
+
+    _make_available(db)
+    assert d.run_once() == 1
+    (msg,) = _messages(db)
+    assert msg.status == "done"
+    assert msg.attempts == 2
+    assert msg.last_error is None
+
+
+def test_backoff_is_capped():
+    d = outbox.Dispatcher(registry={}, backoff_base=2.0, backoff_max=60.0)
+    assert d._backoff(3) == 8.0
+    assert d._backoff(20) == 60.0
+
+
+def test_dead_after_max_attempts(db):
+    registry = {}
+    outbox.register("t", registry)(lambda p: (_ for _ in ()).throw(ValueError("always")))
+    _enqueue(db)
+
+    d = outbox.Dispatcher(registry=registry, max_attempts=3)
+    for _ in range(3):
+        assert d.run_once() == 1
+        _make_available(db)
+    assert d.run_once() == 0
+
+    (msg,) = _messages(db)
+    assert msg.status == "dead"
+    assert msg.attempts == 3
+    assert msg.processed_at is not None
+    assert d.dead == 1
+
+
+def test_stats(db):
+    registry = {}
+    outbox.register("ok", registry)(lambda p: None)
+    outbox.register("bad", registry)(lambda p: (_ for _ in ()).throw(ValueError("x")))
+    _enqueue(db, 3, topic="ok")
+    _enqueue(db, 1, topic="bad")
+
+    d = outbox.Dispatcher(registry=registry, max_attempts=1, worker_id="w1")
+    d.run_once()
+    _enqueue(db, 2, topic="ok")  # 尚未處理
+
+    stats = d.stats()
+    assert stats["worker_id"] == "w1"
+    assert (stats["processed"], stats["failed"], stats["dead"], stats["batches"]) == (3, 1, 1, 1)
+    assert (stats["pending"], stats["done"], stats["dead"]) == (2, 3, 1)
+    assert stats["lag_seconds"] >= 0
+    assert stats["throughput_per_sec"] > 0
+
+
+class FakeMailer:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, to, subject, body):
+        self.sent.append((to, subject, body))
+
+
+@pytest.fixture
+def fake_mailer():
+    fake = FakeMailer()
+    original = mailer.get_mailer()
+    mailer.set_mailer(fake)
+    yield fake
+    mailer.set_mailer(original)
+
+
+def test_receipt_handler_uses_mailer(fake_mailer):
+    outbox.send_receipt({
+        "email": "buyer@example.com", "status": "paid",
+        "course_id": "c1", "amount_twd": 1490, "session_id": "cs_1",
+    })
+    outbox.send_receipt({"email": "x@example.com", "status": "unpaid"})
+    outbox.send_receipt({"email": None, "status": "paid"})
+
+    assert len(fake_mailer.sent) == 1
+    to, subject, body = fake_mailer.sent[0]
+    assert to == "buyer@example.com"
+    assert "c1" in subject
+    assert "1490" in body and "cs_1" in body
+
+
+def test_receipt_is_registered_last():
+    handlers = outbox.get_registry()[outbox.TOPIC_PAYMENT_COMPLETED]
+    assert handlers[-1] is outbox.send_receipt
@@ -0,0 +1,143 @@
+# tests/test_partitions.py
+"""SQLite 分區：rotate 搬移、payments_source 剪枝、locate 搬回熱表、detach 匯出後移除。"""
+
+from __future__ import annotations
+
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, inspect, select, text
+
+from services import partitions
+from services.db import get_engine
+from services.models import Payment
+
+NOW = datetime(2024, 6, 15)
+
+
+def _add(get_session, sid, created_at, status="paid"):
+    with get_session() as s:
+        s.add(Payment(stripe_session_id=sid, course_id="c1", amount_twd=100,
+                      status=status, created_at=created_at))
+        s.commit()
+
+
+@pytest.fixture
+def seeded(db):
+    """1～3 月各兩筆（已結束、超出 hot_months=3）＋ 5 月一筆；id 最大的那筆落在 2 月。"""
+    _add(db, "cs_jan_1", datetime(2024, 1, 5))
+    _add(db, "cs_jan_2", datetime(2024, 1, 20), status="unpaid")
+    _add(db, "cs_mar_1", datetime(2024, 3, 3), status="unpaid")
+    _add(db, "cs_mar_2", datetime(2024, 3, 9), status="expired")
+    _add(db, "cs_may_1", datetime(2024, 5, 1))
+    _add(db, "cs_feb_1", datetime(2024, 2, 2))
+    _add(db, "cs_feb_2", datetime(2024, 2, 8))
+    return db
+
+
+def _ids(conn, table):
+    return set(conn.scalars(text(f"SELECT stripe_session_id FROM {table}")))
+
+
+def test_rotate_moves_closed_months_and_keeps_max_id(seeded):
+    result = partitions.rotate(now=NOW, hot_months=3)
+
+    assert result["hot_since"] == "2024-04-01"
+    assert result["moved"] == {"payments_202401": 2, "payments_202402": 1, "payments_202403": 2}
+    with get_engine().connect() as conn:
+        # 熱表留下 id 最大的 cs_feb_2，避免 SQLite 重複配發封存表的 id
+        assert _ids(conn, "payments") == {"cs_may_1", "cs_feb_2"}
+        assert _ids(conn, "payments_202402") == {"cs_feb_1"}
+        assert conn.scalar(text("SELECT count(*) FROM payments_all")) == 7
+
+    assert partitions.rotate(now=NOW, hot_months=3)["moved"] == {}  # 再跑一次沒有可搬的
+
+
+def test_payments_source_unions_only_overlapping_months(seeded):
+    partitions.rotate(now=NOW, hot_months=3)
+
+    with seeded() as s:
+        P = partitions.payments_source(s, datetime(2024, 2, 10), datetime(2024, 3, 5))
+        sql = str(select(P.id).compile())
+        assert "payments_202402" in sql and "payments_202403" in sql
+        assert "payments_202401" not in sql
+        rows = s.scalars(
+            select(P.stripe_session_id)
+            .where(P.created_at >= datetime(2024, 2, 1), P.created_at < datetime(2024, 4, 1))
+        ).all()
+        assert sorted(rows) == ["cs_feb_1", "cs_feb_2", "cs_mar_1", "cs_mar_2"]
+
+        assert partitions.payments_source(s, datetime(2024, 5, 1)) is Payment  # 只需熱表
+
+
+def test_locate_promotes_archived_row_and_rotate_moves_it_back(seeded):
+    partitions.rotate(now=NOW, hot_months=3)
+
+    with seeded() as s:
+        pay = partitions.locate(s, stripe_session_id="cs_jan_1")
+        assert pay is not None and pay.created_at == datetime(2024, 1, 5)
+        pay.status = "refunded"
+        s.commit()
+
+    with get_engine().connect() as conn:
+        assert "cs_jan_1" in _ids(conn, "payments")
+        assert "cs_jan_1" not in _ids(conn, "payments_202401")
+        assert conn.scalar(text(
+            "SELECT status FROM payments_all WHERE stripe_session_id = 'cs_jan_1'"
+        )) == "refunded"
+
+    assert partitions.rotate(now=NOW, hot_months=3)["moved"] == {"payments_202401": 1}
+    with get_engine().connect() as conn:
+        assert _ids(conn, "payments_202401") == {"cs_jan_1", "cs_jan_2"}
+        assert "cs_jan_1" not in _ids(conn, "payments")
+
+    with seeded() as s:
+        assert partitions.locate(s, stripe_session_id="cs_nope") is None
+
+
+def test_detach_refuses_entitled_then_exports_and_drops(seeded, tmp_path):
+    partitions.rotate(now=NOW, hot_months=3)
+    cold = tmp_path / "cold"
+
+    with pytest.raises(ValueError, match="entitled"):
+        partitions.detach(datetime(2024, 1, 1), cold)
+    assert "payments_202401" in inspect(get_engine()).get_table_names()
+
+    target = partitions.detach(datetime(2024, 1, 1), cold, allow_entitled=True)
+
+    assert target == cold / "payments_202401.jsonl.gz"
+    assert not list(cold.glob("*.tmp"))
+    with gzip.open(target, "rt", encoding="utf-8") as fh:
+        rows = [json.loads(line) for line in fh]
+    assert [r["stripe_session_id"] for r in rows] == ["cs_jan_1", "cs_jan_2"]
+    assert rows[0]["status"] == "paid"
+
+    with get_engine().connect() as conn:
+        assert "payments_202401" not in inspect(conn).get_table_names()
+        assert conn.scalar(text("SELECT count(*) FROM payments_all")) == 5
+    with seeded() as s:
+        assert s.scalar(select(func.count()).select_from(
+            partitions.payments_source(s, datetime(2024, 1, 1)))) == 5
+
+
+def test_detach_without_entitled_rows_and_failed_write_cleans_up(seeded, tmp_path, monkeypatch):
+    partitions.rotate(now=NOW, hot_months=3)
+    cold = tmp_path / "cold"
+
+    def broken_fsync(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(partitions.os, "fsync", broken_fsync)
+    with pytest.raises(OSError):
+        partitions.detach(datetime(2024, 3, 1), cold)
+    assert list(cold.iterdir()) == []  # 暫存檔已移除
+    assert "payments_202403" in inspect(get_engine()).get_table_names()  # 交易回滾，分區仍在
+
+    monkeypatch.undo()
+    target = partitions.detach(datetime(2024, 3, 1), cold)  # 2024-03 只有未付款 / 過期
+    assert target.exists()
+
+    with pytest.raises(ValueError, match="not found"):
+        partitions.detach(datetime(2024, 3, 1), cold)
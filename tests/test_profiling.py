@@ -0,0 +1,35 @@
+# tests/test_profiling.py
+"""延遲統計的 DB 計時：開始時間記在 execution context，失敗的語句不會在連線上留下殘留。"""
+
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from services import profiling
+from services.db import get_engine
+
+
+def test_db_timer_survives_failed_statements(app):
+    engine = get_engine()
+    timers = {}
+    token = profiling._current.set(timers)
+    try:
+        with engine.connect() as conn:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    conn.execute(text("SELECT * FROM no_such_table"))
+            conn.execute(text("SELECT 1"))
+            assert not any(k.startswith("coursepay") for k in conn.info)
+    finally:
+        profiling._current.reset(token)
+    assert timers["db"] > 0
+
+
+def test_request_records_db_time(app):
+    profiling.reset()
+    assert app.test_client().get("/admin/outbox/stats").status_code == 200
+    stats = profiling.snapshot()["admin.outbox_stats"]
+    assert stats["total"]["count"] == 1
+    assert stats["db"]["max_ms"] > 0
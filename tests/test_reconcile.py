@@ -0,0 +1,191 @@
+# tests/test_reconcile.py
+"""對帳：以本地假 lister 取代 Stripe（與 stripe-mock 相同的 created 範圍 + cursor 分頁語意）。"""
+
+from __future__ import annotations
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+from services import entitlements
+from services import reconcile as reconcile_mod
+from services.models import OutboxMessage, Payment, User
+from services.reconcile import reconcile
+
+START = datetime(2020, 3, 1, tzinfo=timezone.utc)
+
+
+def make_session(i, created, payment_status="paid", status="complete"):
+    return {
+        "id": f"cs_{i:04d}",
+        "created": int(created.timestamp()),
+        "status": status,
+        "payment_status": payment_status,
+        "amount_total": 149000,
+        "payment_intent": f"pi_{i:04d}",
+        "metadata": {"course_id": "c1"},
+        "customer_details": {"email": f"u{i}@example.com"},
+    }
+
+
+class FakeLister:
+    """依 created 篩選、id 排序，starting_after 之後取 limit 筆；可指定第幾次呼叫失敗。"""
+
+    def __init__(self, sessions, fail_on_calls=()):
+        self.sessions = sorted(sessions, key=lambda o: o["id"])
+        self.fail_on_calls = set(fail_on_calls)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, gte, lt, starting_after, limit):
+        with self._lock:
+            self.calls.append((gte, lt, starting_after, limit))
+            n = len(self.calls)
+        if n in self.fail_on_calls:
+            raise ConnectionError("stripe unavailable")
+        rows = [o for o in self.sessions if gte <= o["created"] < lt]
+        if starting_after:
+            rows = [o for o in rows if o["id"] > starting_after]
+        return rows[:limit], len(rows) > limit
+
+
+def _payments(get_session):
+    with get_session() as s:
+        return {p.stripe_session_id: p for p in s.scalars(select(Payment))}
+
+
+def _outbox_count(get_session):
+    with get_session() as s:
+        return s.scalar(select(func.count()).select_from(OutboxMessage))
+
+
+def test_pages_and_inserts_missing_with_stripe_created(db):
+    sessions = [make_session(i, START + timedelta(minutes=i)) for i in range(25)]
+    sessions.append(make_session(99, START, status="open", payment_status="unpaid"))  # 未完成：略過
+    lister = FakeLister(sessions)
+
+    report = reconcile(START, START + timedelta(days=1), lister, page_size=10)
+
+    assert report.ok
+    assert [c[2] for c in lister.calls] == [None, "cs_0009", "cs_0019"]
+    assert (report.fetched, report.missing, report.repaired) == (25, 25, 25)
+    pays = _payments(db)
+    assert len(pays) == 25
+    # created_at 取 Stripe 的 created，不是補寫當下
+    assert pays["cs_0003"].created_at == datetime(2020, 3, 1, 0, 3)
+    assert pays["cs_0003"].amount_twd == 1490
+    assert _outbox_count(db) == 25
+
+
+def test_repairs_lagging_status(db):
+    with db() as s:
+        s.add(Payment(stripe_session_id="cs_0000", course_id="c1", amount_twd=1490, status="unpaid"))
+        s.commit()
+    lister = FakeLister([make_session(0, START)])
+
+    report = reconcile(START, START + timedelta(days=1), lister)
+
+    assert (report.missing, report.status_fixed, report.repaired) == (0, 1, 1)
+    assert _payments(db)["cs_0000"].status == "paid"
+    assert _outbox_count(db) == 1
+
+
+def test_refunded_rows_are_not_repaired(db):
+    with db() as s:
+        s.add(User(id=1, email="u@example.com"))
+        s.add(Payment(stripe_session_id="cs_0000", course_id="c1", amount_twd=1490,
+                      status="refunded", user_id=1))
+        s.add(Payment(stripe_session_id="cs_0001", course_id="c2", amount_twd=1490,
+                      status="partially_refunded", user_id=1))
+        s.commit()
+    sessions = [make_session(0, START), make_session(1, START)]
+    for obj in sessions:
+        obj["metadata"]["user_id"] = "1"
+
+    report = reconcile(START, START + timedelta(days=1), FakeLister(sessions))
+
+    assert (report.missing, report.status_fixed, report.repaired) == (0, 0, 0)
+    pays = _payments(db)
+    assert (pays["cs_0000"].status, pays["cs_0001"].status) == ("refunded", "partially_refunded")
+    assert _outbox_count(db) == 0
+    assert entitlements.entitled_courses(1) == frozenset({"c2"})
+
+
+def test_row_written_concurrently_is_not_duplicated(db, monkeypatch):
+    """比對之後、寫入之前 webhook 先寫了同一 session：ON CONFLICT 略過，不重複寫 outbox。"""
+    lister = FakeLister([make_session(0, START), make_session(1, START)])
+    reconcile(START, START + timedelta(days=1), FakeLister([make_session(0, START)]))
+    monkeypatch.setattr(reconcile_mod, "_existing_status", lambda s, ids: {})
+
+    report = reconcile(START, START + timedelta(days=1), lister)
+
+    assert report.ok
+    assert report.repaired == 1
+    assert sorted(_payments(db)) == ["cs_0000", "cs_0001"]
+    assert _outbox_count(db) == 2
+
+
+def test_no_change_when_in_sync(db):
+    sessions = [make_session(i, START + timedelta(hours=i)) for i in range(5)]
+    reconcile(START, START + timedelta(days=1), FakeLister(sessions))
+    before = _outbox_count(db)
+
+    report = reconcile(START, START + timedelta(days=1), FakeLister(sessions))
+
+    assert report.ok
+    assert (report.fetched, report.missing, report.status_fixed, report.repaired) == (5, 0, 0, 0)
+    assert _outbox_count(db) == before
+    assert len(_payments(db)) == 5
+
+
+def test_dry_run_writes_nothing(db):
+    lister = FakeLister([make_session(i, START) for i in range(3)])
+    report = reconcile(START, START + timedelta(days=1), lister, dry_run=True)
+    assert report.missing == 3
+    assert report.repaired == 0
+    assert _payments(db) == {}
+
+
+def test_failed_window_is_reported_and_checkpoint_resumes(db, tmp_path):
+    sessions = [make_session(i, START + timedelta(minutes=i)) for i in range(25)]
+    ckpt = tmp_path / "ckpt.json"
+
+    # 第 2 頁失敗：第 1 頁已寫入，checkpoint 記下 cursor
+    first = FakeLister(sessions, fail_on_calls={2})
+    report = reconcile(START, START + timedelta(days=1), first, page_size=10, checkpoint_path=ckpt)
+    assert not report.ok
+    assert len(report.failed_windows) == 1
+    assert "stripe unavailable" in report.failed_windows[0]
+    assert report.as_dict()["failed_windows"] == report.failed_windows
+    assert len(_payments(db)) == 10
+    (state,) = json.loads(ckpt.read_text())["windows"].values()
+    assert state == {"cursor": "cs_0009", "done": False}
+
+    # 以同一 checkpoint 重跑：從 cursor 接續，不重抓第 1 頁
+    second = FakeLister(sessions)
+    report = reconcile(START, START + timedelta(days=1), second, page_size=10, checkpoint_path=ckpt)
+    assert report.ok
+    assert second.calls[0][2] == "cs_0009"
+    assert report.missing == 15
+    assert len(_payments(db)) == 25
+
+    # 全部完成後再跑：沒有待處理的時間窗，不會呼叫 lister
+    third = FakeLister(sessions)
+    report = reconcile(START, START + timedelta(days=1), third, checkpoint_path=ckpt)
+    assert report.windows == 0
+    assert third.calls == []
+
+
+def test_windows_are_split_and_fetched_concurrently(db):
+    sessions = [make_session(i, START + timedelta(hours=6 * i)) for i in range(8)]  # 跨 2 天
+    lister = FakeLister(sessions)
+
+    report = reconcile(
+        START, START + timedelta(days=2), lister, concurrency=4, window=timedelta(hours=12)
+    )
+
+    assert report.windows == 4
+    assert len({(c[0], c[1]) for c in lister.calls}) == 4
+    assert report.missing == 8
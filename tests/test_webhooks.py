@@ -0,0 +1,117 @@
+# tests/test_webhooks.py
+"""Webhook handler：直接呼叫 handler（不經簽章驗證），確認重送事件不會改動已付款 / 已退款的紀錄。"""
+
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import func, select
+
+from services import entitlements, webhooks
+from services.models import OutboxMessage, Payment, User, WebhookEvent
+
+
+def _session_obj(payment_status="paid"):
+    return {
+        "id": "cs_1",
+        "created": 1583020800,
+        "status": "complete",
+        "payment_status": payment_status,
+        "amount_total": 149000,
+        "payment_intent": "pi_1",
+        "metadata": {"course_id": "c1", "user_id": "1"},
+        "customer_details": {"email": "u@example.com"},
+    }
+
+
+def _call(get_session, event_type, obj):
+    with get_session() as s:
+        webhooks.get_handler(event_type)(s, obj, {"type": event_type})
+
+
+def _state(get_session):
+    with get_session() as s:
+        status = s.scalar(select(Payment.status).where(Payment.stripe_session_id == "cs_1"))
+        outbox_n = s.scalar(select(func.count()).select_from(OutboxMessage))
+    return status, outbox_n
+
+
+@pytest.fixture
+def user(db):
+    with db() as s:
+        s.add(User(id=1, email="u@example.com"))
+        s.commit()
+    return 1
+
+
+def test_completed_inserts_and_enqueues_once(db, user):
+    _call(db, "checkout.session.completed", _session_obj())
+    _call(db, "checkout.session.completed", _session_obj())  # 重送
+    assert _state(db) == ("paid", 1)
+
+
+def test_async_success_after_unpaid_enqueues(db, user):
+    _call(db, "checkout.session.completed", _session_obj("unpaid"))
+    assert _state(db) == ("unpaid", 0)
+    _call(db, "checkout.session.async_payment_succeeded", _session_obj())
+    assert _state(db) == ("paid", 1)
+
+
+@pytest.mark.parametrize("refund, expected_status, entitled", [
+    ({"amount": 149000, "amount_refunded": 50000}, "partially_refunded", {"c1"}),
+    ({"amount": 149000, "amount_refunded": 149000, "refunded": True}, "refunded", set()),
+])
+def test_redelivered_completed_keeps_refund(db, user, refund, expected_status, entitled):
+    _call(db, "checkout.session.completed", _session_obj())
+    _call(db, "charge.refunded", {"payment_intent": "pi_1", **refund})
+    assert _state(db) == (expected_status, 1)
+
+    for event_type in ("checkout.session.completed",
+                       "checkout.session.async_payment_succeeded",
+                       "checkout.session.async_payment_failed",
+                       "checkout.session.expired"):
+        _call(db, event_type, _session_obj())
+
+    assert _state(db) == (expected_status, 1)  # 狀態不變、沒有重複的 outbox 訊息
+    assert entitlements.entitled_courses(user) == frozenset(entitled)
+
+
+def test_concurrent_insert_of_same_session_is_skipped(db, user, monkeypatch):
+    """先查再寫之間另一個 worker 已寫入同一 session：不新增第二筆、不重複寫 outbox。"""
+    _call(db, "checkout.session.completed", _session_obj())
+    real_locate = webhooks.partitions.locate
+    calls = []
+
+    def racy_locate(s, **eq):
+        calls.append(eq)
+        return None if len(calls) == 1 else real_locate(s, **eq)
+
+    monkeypatch.setattr(webhooks.partitions, "locate", racy_locate)
+    _call(db, "checkout.session.completed", _session_obj())
+
+    with db() as s:
+        assert s.scalar(select(func.count()).select_from(Payment)) == 1
+    assert _state(db) == ("paid", 1)
+
+
+def test_refund_of_legacy_payment_without_payment_intent(db, user):
+    """stripe_payment_intent_id 欄位加入前的付款：由保存的 checkout 事件找回對應的 session。"""
+    obj = _session_obj()
+    with db() as s:
+        s.add(Payment(stripe_session_id="cs_1", course_id="c1", amount_twd=1490,
+                      status="paid", user_id=user))
+        s.add(WebhookEvent(event_id="evt_1", type="checkout.session.completed",
+                           payload={"id": "evt_1", "type": "checkout.session.completed",
+                                    "data": {"object": obj}}))
+        s.commit()
+    assert entitlements.entitled_courses(user) == frozenset({"c1"})
+
+    _call(db, "charge.refunded", {"payment_intent": "pi_1", "amount": 149000,
+                                  "amount_refunded": 149000, "refunded": True})
+
+    with db() as s:
+        pay = s.scalars(select(Payment)).one()
+        assert (pay.status, pay.stripe_payment_intent_id) == ("refunded", "pi_1")
+    assert entitlements.entitled_courses(user) == frozenset()
+
+    # 查不到對應事件的 payment_intent 仍只記錄 warning
+    _call(db, "charge.refunded", {"payment_intent": "pi_unknown", "refunded": True})